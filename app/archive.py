@@ -0,0 +1,141 @@
+"""
+冷设备归档
+
+长期没有心跳的设备（last_check 早于 DEVICE_ARCHIVE_AFTER_DAYS 天）由后台任务分块移入 archived_devices 表，
+devices 表及其索引只保留近期活跃的设备。每块一个短事务（INSERT ... SELECT + DELETE）并单独提交
+（开启 SQLITE_PRODUCTION 时经写入队列执行），SQLite 下心跳等写入可以在块之间获得写锁。
+
+归档的设备从计数器中扣除并写入墓碑（增量同步的客户端会将其删除）。设备再次心跳时，
+心跳处理照常按新设备插入，再通过 restore_devices 取回归档中的授权状态、备注和创建时间。
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import DateTime, and_, delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.changes import add_tombstones
+from app.counters import CounterDelta
+from app.database import AsyncSessionLocal, settings
+from app.decision_cache import decision_cache
+from app.events import device_events
+from app.models import ArchivedDevice, Device
+from app.sqlite_writer import sqlite_writer
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# 归档时复制的列（生成列和变更版本号在恢复时重新生成）
+_ARCHIVE_FIELDS = (
+    "device_id", "software_name", "device_info", "device_info_digest", "remark",
+    "is_authorized", "created_at", "updated_at", "last_check",
+)
+# IN 查询每批的 device_id 数量（SQLite 绑定参数数量有限）
+_LOOKUP_CHUNK = 500
+
+
+async def archive_devices(db: AsyncSession, cutoff: datetime, chunk_size: int) -> int:
+    """把 last_check 早于 cutoff 的设备分块移入归档表，返回归档的设备数"""
+    archived = 0
+    last_id = 0
+    while True:
+        async def move(session: AsyncSession, last_id: int = last_id) -> Tuple[List[int], List[str]]:
+            ids = list(await session.scalars(
+                select(Device.id)
+                .where(Device.id > last_id, Device.last_check < cutoff)
+                .order_by(Device.id)
+                .limit(chunk_size)
+            ))
+            if not ids:
+                return [], []
+            # 查询之后收到心跳或已被移走的设备不再满足条件，不会被移走，其归档记录也不受影响（重复执行的块不做任何修改）
+            stale = and_(Device.id.in_(ids), Device.last_check < cutoff)
+            await session.execute(
+                delete(ArchivedDevice).where(ArchivedDevice.device_id.in_(select(Device.device_id).where(stale)))
+            )
+            # 写事务已经开始（SQLite 持有写锁），MySQL 再锁定这些行：之后的语句看到同一组设备
+            rows = (await session.execute(
+                select(Device.id, Device.device_id, Device.software_name, Device.is_authorized)
+                .where(stale)
+                .with_for_update()
+            )).all()
+            if not rows:
+                return ids, []
+            moving = Device.id.in_([row.id for row in rows])
+            await session.execute(
+                insert(ArchivedDevice).from_select(
+                    [*_ARCHIVE_FIELDS, "archived_at"],
+                    select(*[getattr(Device, name) for name in _ARCHIVE_FIELDS], literal(datetime.now(), DateTime))
+                    .where(moving),
+                )
+            )
+            await session.execute(delete(Device).where(moving).execution_options(synchronize_session=False))
+            counters = CounterDelta()
+            for row in rows:
+                counters.device_removed(row.software_name, row.is_authorized)
+            await counters.apply(session)
+            await add_tombstones(session, [row.device_id for row in rows])
+            return ids, [row.device_id for row in rows]
+        
+        # 每块的查询和移动在一个短事务中执行（经 SQLite 写入队列）
+        ids, moved = await sqlite_writer.run(db, move)
+        if not ids:
+            break
+        for device_id in moved:
+            decision_cache.invalidate(device_id)
+        device_events.publish_many("archived", moved)
+        archived += len(moved)
+        if len(ids) < chunk_size:
+            break
+        last_id = ids[-1]
+    if archived:
+        logger.info(f"已归档 {archived} 个长期未心跳的设备")
+    return archived
+
+
+async def restore_devices(db: AsyncSession, device_ids: List[str]) -> Dict[str, Any]:
+    """
+    在当前事务中恢复归档设备（设备行已由心跳重新插入）
+
+    授权状态、备注和创建时间取归档中的值；心跳未携带软件名或设备信息时也使用归档中的值。
+
+    Returns:
+        device_id -> 归档记录（只包含确实被归档过的设备）
+    """
+    archived: Dict[str, Any] = {}
+    for i in range(0, len(device_ids), _LOOKUP_CHUNK):
+        result = await db.execute(
+            select(ArchivedDevice).where(ArchivedDevice.device_id.in_(device_ids[i:i + _LOOKUP_CHUNK]))
+        )
+        archived.update((row.device_id, row) for row in result.scalars())
+    for row in archived.values():
+        await db.execute(
+            update(Device).where(Device.device_id == row.device_id)
+            .values(
+                software_name=func.coalesce(Device.software_name, row.software_name),
+                remark=row.remark,
+                is_authorized=row.is_authorized,
+                created_at=row.created_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if row.device_info is not None:
+            await db.execute(
+                update(Device).where(Device.device_id == row.device_id, Device.device_info_digest.is_(None))
+                .values(device_info=row.device_info, device_info_digest=row.device_info_digest)
+                .execution_options(synchronize_session=False)
+            )
+    if archived:
+        await db.execute(delete(ArchivedDevice).where(ArchivedDevice.device_id.in_(list(archived))))
+        logger.info(f"已恢复 {len(archived)} 个归档设备")
+    return archived
+
+
+async def _archive():
+    cutoff = datetime.now() - timedelta(days=settings.device_archive_after_days)
+    async with AsyncSessionLocal() as db:
+        await archive_devices(db, cutoff, max(1, settings.bulk_chunk_size))
+
+
+device_archiver = PeriodicTask("device-archive", settings.device_archive_interval, _archive)
@@ -7,9 +7,16 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy.orm.attributes import set_committed_value
+from app.database import get_db, settings
+from app.hashing import password_hasher
+from app.metrics import DECRYPT_FAILURES, time_stage
 from app.models import User
+from app.sqlite_writer import sqlite_writer
+from app.token_cache import CurrentUser, token_cache
 import os
 import json
 import base64
@@ -48,9 +55,11 @@ def decrypt_request_data(encrypted_data: str) -> Optional[Dict[str, Any]]:
     if not cipher:
         return None
     try:
-        decrypted = cipher.decrypt(encrypted_data.encode('utf-8'))
+        with time_stage("fernet_decrypt"):
+            decrypted = cipher.decrypt(encrypted_data.encode('utf-8'))
         return json.loads(decrypted.decode('utf-8'))
     except Exception as e:
+        DECRYPT_FAILURES.labels("v1").inc()
         logger.error(f"解密失败: {e}")
         return None
 
@@ -61,7 +70,8 @@ def encrypt_response_data(data: Dict[str, Any]) -> Optional[str]:
         return None
     try:
         json_str = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
-        return cipher.encrypt(json_str.encode('utf-8')).decode('utf-8')
+        with time_stage("fernet_encrypt"):
+            return cipher.encrypt(json_str.encode('utf-8')).decode('utf-8')
     except Exception as e:
         logger.error(f"加密失败: {e}")
         return None
@@ -105,23 +115,90 @@ def verify_token(token: str) -> Optional[dict]:
         return None
 
 
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
     """根据用户名获取用户"""
-    return db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    """验证用户"""
-    user = get_user_by_username(db, username)
+async def resolve_token(db: AsyncSession, token: str) -> Optional[CurrentUser]:
+    """根据令牌获取用户快照：优先读取令牌缓存，未命中时校验签名并查询用户"""
+    if settings.token_cache_enabled:
+        cached = token_cache.get(token)
+        if cached is not None:
+            return cached
+    
+    payload = verify_token(token)
+    if payload is None:
+        return None
+    username: str = payload.get("sub")
+    if username is None:
+        return None
+    user = await get_user_by_username(db, username)
+    if user is None:
+        return None
+    # 修改密码或禁用后凭据版本号递增，之前签发的令牌失效
+    if payload.get("cv", 0) != (user.credential_version or 0):
+        return None
+    
+    if settings.token_cache_enabled and user.is_active:
+        return token_cache.put(token, user, payload.get("exp"))
+    return CurrentUser.from_user(user, payload.get("exp") or 0)
+
+
+def issue_access_token(user: User) -> str:
+    """为用户签发访问令牌（带当前凭据版本号）"""
+    return create_access_token(
+        data={"sub": user.username, "cv": user.credential_version or 0},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+
+async def revoke_user_tokens(db: AsyncSession, user: User, password_hash: Optional[str] = None):
+    """
+    递增凭据版本号并提交，使该用户之前签发的令牌全部失效（修改密码、禁用用户时调用）
+
+    password_hash 不为空时同时更新密码哈希。经 SQLite 写入队列执行，提交后同步到 user 对象。
+    """
+    values = {"credential_version": (user.credential_version or 0) + 1}
+    if password_hash is not None:
+        values["password_hash"] = password_hash
+    
+    async def write(session: AsyncSession):
+        await session.execute(update(User).where(User.id == user.id).values(**values))
+    
+    await sqlite_writer.run(db, write)
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    token_cache.invalidate_user(user.username)
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    """验证用户（密码校验在哈希进程池中执行，不阻塞事件循环）"""
+    user = await get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         return None
+    # 轮数与校准结果相差过大时用本次的明文重新哈希
+    if password_hasher.needs_rehash(user.password_hash):
+        old_hash = user.password_hash
+        new_hash = await password_hasher.hash(password)
+        
+        async def write(session: AsyncSession):
+            # 只在密码未被并发修改时替换
+            await session.execute(
+                update(User).where(User.id == user.id, User.password_hash == old_hash).values(password_hash=new_hash)
+            )
+        
+        await sqlite_writer.run(db, write)
+        set_committed_value(user, "password_hash", new_hash)
+        logger.info(f"用户 {user.username} 的密码哈希已按新轮数重新生成")
     return user
 
 
 def create_user(db: Session, username: str, password: str, is_admin: bool = False) -> User:
-    """创建用户"""
+    """创建用户（同步会话，启动初始化时使用）"""
     user = User(
         username=username,
         password_hash=get_password_hash(password),
@@ -135,9 +212,9 @@ def create_user(db: Session, username: str, password: str, is_admin: bool = Fals
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """获取当前用户（从JWT令牌）"""
+    db: AsyncSession = Depends(get_db)
+) -> CurrentUser:
+    """获取当前用户（从JWT令牌），返回只读的用户快照"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无效的认证凭据",
@@ -147,17 +224,7 @@ async def get_current_user(
     if not credentials:
         raise credentials_exception
     
-    token = credentials.credentials
-    payload = verify_token(token)
-    
-    if payload is None:
-        raise credentials_exception
-    
-    username: str = payload.get("sub")
-    if username is None:
-        raise credentials_exception
-    
-    user = get_user_by_username(db, username)
+    user = await resolve_token(db, credentials.credentials)
     if user is None:
         raise credentials_exception
     
@@ -169,23 +236,13 @@ async def get_current_user(
 
 async def get_current_user_optional(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> Optional[User]:
+    db: AsyncSession = Depends(get_db)
+) -> Optional[CurrentUser]:
     """获取当前用户（可选，不强制要求登录）"""
     if not credentials:
         return None
     
-    token = credentials.credentials
-    payload = verify_token(token)
-    
-    if payload is None:
-        return None
-    
-    username: str = payload.get("sub")
-    if username is None:
-        return None
-    
-    user = get_user_by_username(db, username)
+    user = await resolve_token(db, credentials.credentials)
     if user is None or not user.is_active:
         return None
     
@@ -195,7 +252,7 @@ async def get_current_user_optional(
 
 
 def init_admin_user(db: Session):
-    """初始化管理员用户"""
+    """初始化管理员用户（同步会话）"""
     admin_username = os.getenv("ADMIN_USERNAME", "admin")
     admin_password = os.getenv("ADMIN_PASSWORD", "admin123")
     
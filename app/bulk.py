@@ -0,0 +1,116 @@
+"""
+设备批量操作
+
+按 device_id 列表或过滤条件批量授权、撤销、删除设备。目标设备分块处理：每块的查询和一条
+UPDATE / DELETE 语句在一个短事务中执行并单独提交，SQLite 下心跳等其他写入可以在块之间获得写锁
+（开启 SQLITE_PRODUCTION 时每块经写入队列执行）。
+计数器、墓碑、决策缓存和设备事件与单个设备的操作保持一致。
+"""
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.changes import add_tombstones
+from app.counters import CounterDelta
+from app.decision_cache import decision_cache
+from app.events import device_events
+from app.models import Device
+from app.sqlite_writer import sqlite_writer
+
+logger = logging.getLogger(__name__)
+
+
+async def _for_each_chunk(db: AsyncSession, columns: Sequence[Any], device_ids: Optional[List[str]],
+                          conditions: List[Any], chunk_size: int,
+                          write: Callable[[AsyncSession, list], Awaitable[int]]) -> AsyncIterator[Tuple[list, int]]:
+    """
+    分块处理目标设备：device_id 列表按列表分块，过滤条件按 id 递增分块
+
+    每块的查询和 write(session, rows) 在同一个写事务中执行（经 SQLite 写入队列）并单独提交，
+    产出 (本块的设备行, write 的返回值)。
+    """
+    offset = 0
+    last_id = 0
+    while True:
+        if device_ids is not None:
+            if offset >= len(device_ids):
+                return
+            query = select(*columns).where(Device.device_id.in_(device_ids[offset:offset + chunk_size]), *conditions)
+            offset += chunk_size
+        else:
+            query = select(*columns).where(Device.id > last_id, *conditions).order_by(Device.id).limit(chunk_size)
+        
+        async def job(session: AsyncSession, query=query) -> Tuple[list, int]:
+            rows = (await session.execute(query)).all()
+            return rows, (await write(session, rows) if rows else 0)
+        
+        rows, count = await sqlite_writer.run(db, job)
+        if device_ids is None:
+            if not rows:
+                return
+            yield rows, count
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1].id
+        else:
+            yield rows, count
+
+
+async def bulk_set_authorized(db: AsyncSession, authorized: bool, device_ids: Optional[List[str]],
+                              conditions: List[Any], chunk_size: int) -> List[int]:
+    """批量修改授权状态，返回每块实际修改的设备数"""
+    affected: List[int] = []
+    columns = (Device.id, Device.device_id, Device.software_name)
+    # 只处理授权状态需要变化的设备
+    conditions = [*conditions, Device.is_authorized != authorized]
+    
+    async def write(session: AsyncSession, rows: list) -> int:
+        result = await session.execute(
+            update(Device)
+            .where(Device.id.in_([row.id for row in rows]), Device.is_authorized != authorized)
+            .values(is_authorized=authorized, updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        counters = CounterDelta()
+        for row in rows:
+            counters.add(row.software_name, authorized=1 if authorized else -1)
+        await counters.apply(session)
+        return result.rowcount
+    
+    async for rows, count in _for_each_chunk(db, columns, device_ids, conditions, chunk_size, write):
+        changed = [row.device_id for row in rows]
+        for device_id in changed:
+            decision_cache.invalidate(device_id)
+        device_events.publish_many("authorized" if authorized else "revoked", changed)
+        affected.append(count)
+    return affected
+
+
+async def bulk_delete(db: AsyncSession, device_ids: Optional[List[str]],
+                      conditions: List[Any], chunk_size: int) -> List[int]:
+    """批量删除设备，返回每块实际删除的设备数"""
+    affected: List[int] = []
+    columns = (Device.id, Device.device_id, Device.software_name, Device.is_authorized)
+    
+    async def write(session: AsyncSession, rows: list) -> int:
+        result = await session.execute(
+            delete(Device).where(Device.id.in_([row.id for row in rows]))
+            .execution_options(synchronize_session=False)
+        )
+        counters = CounterDelta()
+        for row in rows:
+            counters.device_removed(row.software_name, row.is_authorized)
+        await counters.apply(session)
+        await add_tombstones(session, [row.device_id for row in rows])
+        return result.rowcount
+    
+    async for rows, count in _for_each_chunk(db, columns, device_ids, conditions, chunk_size, write):
+        deleted = [row.device_id for row in rows]
+        for device_id in deleted:
+            decision_cache.invalidate(device_id)
+        device_events.publish_many("deleted", deleted)
+        affected.append(count)
+    return affected
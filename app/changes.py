@@ -0,0 +1,131 @@
+"""
+设备增量同步
+
+插入设备和设备状态变化时自动生成变更版本号（Device.change_version，见 app/models.py），
+只刷新 last_check 的心跳不生成新版本；删除设备时写入墓碑。客户端记住上次同步到的版本号，之后只获取变化的设备和已删除的 device_id。
+
+版本号是各 worker 独立生成的微秒时间戳：读取时只返回早于“当前时间 - 稳定窗口”的版本，
+保证其他 worker 稍后提交的较小版本号不会被跳过。
+"""
+import hashlib
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Sequence
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, settings
+from app.models import Device, DeviceTombstone
+from app.sqlite_writer import sqlite_writer
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# 墓碑清理间隔（秒）
+_PRUNE_INTERVAL = 3600.0
+
+
+def _version_before(seconds: float) -> int:
+    """seconds 秒之前对应的版本号"""
+    return int((time.time() - seconds) * 1_000_000)
+
+
+async def add_tombstones(db: AsyncSession, device_ids: Iterable[str]):
+    """在当前事务中为已删除的设备写入墓碑"""
+    rows = [{"device_id": device_id} for device_id in device_ids]
+    if rows:
+        await db.execute(DeviceTombstone.__table__.insert(), rows)
+
+
+async def change_marker(db: AsyncSession) -> str:
+    """
+    设备数据的当前状态标识（最新版本号 + 最新墓碑 + 最新的更新 / 心跳时间），用于生成 ETag
+
+    只刷新 last_check 的心跳不生成新版本号，但会改变列表返回的 last_check / updated_at 和按它们排序的顺序，
+    因此两列的最大值也计入标识。每个最大值单独查询，各自走对应的索引。
+    """
+    device_version = await db.scalar(select(func.max(Device.change_version)))
+    tombstone_version = await db.scalar(select(func.max(DeviceTombstone.change_version)))
+    updated_at = await db.scalar(select(func.max(Device.updated_at)))
+    last_check = await db.scalar(select(func.max(Device.last_check)))
+    return f"{device_version or 0}:{tombstone_version or 0}:{updated_at}:{last_check}"
+
+
+def make_etag(*parts: Any) -> str:
+    raw = ":".join(str(part) for part in parts)
+    return f'W/"{hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()}"'
+
+
+async def read_changes(db: AsyncSession, since: int, limit: int, columns: Sequence[Any]) -> Dict[str, Any]:
+    """
+    读取版本号 since 之后的变更，设备返回 columns 指定的列（需包含 device_id 和 change_version）
+
+    Returns:
+        version: 下次同步传入的版本号
+        has_more: 是否还有未返回的变更（应立即用 version 继续获取）
+        full_resync: since 早于墓碑保留期，删除记录可能已被清理，客户端需要重新加载全部数据
+        devices: 变化的设备（当前状态）
+        deleted: 已删除的 device_id
+    """
+    upper = _version_before(settings.change_settle_seconds)
+    full_resync = since < _version_before(settings.tombstone_retention_days * 86400)
+    result = await db.execute(
+        select(*columns)
+        .where(Device.change_version > since, Device.change_version <= upper)
+        .order_by(Device.change_version)
+        .limit(limit + 1)
+    )
+    items: List[tuple] = [(row["change_version"], dict(row)) for row in result.mappings()]
+    result = await db.execute(
+        select(DeviceTombstone.device_id, DeviceTombstone.change_version)
+        .where(DeviceTombstone.change_version > since, DeviceTombstone.change_version <= upper)
+        .order_by(DeviceTombstone.change_version)
+        .limit(limit + 1)
+    )
+    items += [(row.change_version, row.device_id) for row in result]
+    items.sort(key=lambda item: item[0])
+
+    has_more = len(items) > limit
+    if has_more:
+        # 不同 worker 可能生成相同的版本号，分页边界上同版本的变更留到下一页一起返回
+        boundary = items[limit][0]
+        page = [item for item in items[:limit] if item[0] < boundary] or items[:limit]
+        version = page[-1][0]
+    else:
+        page = items
+        version = max(upper, since)
+
+    devices = [item for _, item in page if isinstance(item, dict)]
+    current = {device["device_id"] for device in devices}
+    # 删除后又重新注册的设备以当前状态为准
+    deleted = [item for _, item in page if isinstance(item, str) and item not in current]
+    return {
+        "version": version,
+        "has_more": has_more,
+        "full_resync": full_resync,
+        "devices": devices,
+        "deleted": deleted,
+    }
+
+
+async def prune_tombstones(db: AsyncSession) -> int:
+    """清理超过保留期的墓碑"""
+    horizon = _version_before(settings.tombstone_retention_days * 86400)
+    
+    async def write(session: AsyncSession) -> int:
+        result = await session.execute(delete(DeviceTombstone).where(DeviceTombstone.change_version < horizon))
+        return result.rowcount
+    
+    deleted = await sqlite_writer.run(db, write)
+    if deleted:
+        logger.info(f"已清理 {deleted} 条设备墓碑")
+    return deleted
+
+
+async def _prune():
+    async with AsyncSessionLocal() as db:
+        await prune_tombstones(db)
+
+
+tombstone_pruner = PeriodicTask("device-tombstone-prune", _PRUNE_INTERVAL, _prune)
@@ -0,0 +1,197 @@
+"""
+设备计数器
+
+设备总数和已授权数按软件名维护在 device_counters 表中，与设备的新增、删除、
+授权状态变化在同一事务内增量更新，设备列表和统计直接读取，不再对 devices 表 count()。
+
+少数情况下计数会出现偏差（例如批量心跳查询之后、写入之前，其中的新设备被并发请求注册；
+单个心跳的 upsert 取不到原软件名，已有设备更换软件名时计数留在原软件名下），
+由定时对账任务按 devices 表重新统计后修正。对账在一个写事务中先锁定计数行再统计（经 SQLite 写入队列执行），
+对账期间的增量更新在其提交之后执行，不会被覆盖。
+"""
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, settings
+from app.models import Device, DeviceCounter
+from app.sqlite_writer import sqlite_writer
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def _counter_key(software_name: Optional[str]) -> str:
+    # 主键不能为 NULL，软件名为空时记在空字符串下
+    return software_name or ""
+
+
+class CounterDelta:
+    """一个事务内累积的计数变化，提交前通过 apply() 一次写入"""
+
+    def __init__(self):
+        self._deltas: Dict[str, List[int]] = {}
+
+    def add(self, software_name: Optional[str], total: int = 0, authorized: int = 0):
+        delta = self._deltas.setdefault(_counter_key(software_name), [0, 0])
+        delta[0] += total
+        delta[1] += authorized
+
+    def device_added(self, software_name: Optional[str], authorized: bool):
+        self.add(software_name, 1, int(authorized))
+
+    def device_removed(self, software_name: Optional[str], authorized: bool):
+        self.add(software_name, -1, -int(authorized))
+
+    def copy(self) -> "CounterDelta":
+        delta = CounterDelta()
+        delta._deltas = {name: list(values) for name, values in self._deltas.items()}
+        return delta
+
+    async def apply(self, db: AsyncSession):
+        rows = [
+            {"software_name": name, "total": total, "authorized": authorized}
+            for name, (total, authorized) in self._deltas.items()
+            if total or authorized
+        ]
+        if rows:
+            await db.execute(_increment_stmt(db.get_bind().dialect.name), rows)
+        self._deltas.clear()
+
+
+@lru_cache(maxsize=None)
+def _increment_stmt(dialect_name: str):
+    """按软件名累加计数（不存在则插入）"""
+    if dialect_name == "mysql":
+        stmt = mysql_insert(DeviceCounter)
+        return stmt.on_duplicate_key_update(
+            total=DeviceCounter.total + stmt.inserted.total,
+            authorized=DeviceCounter.authorized + stmt.inserted.authorized,
+        )
+    stmt = sqlite_insert(DeviceCounter)
+    return stmt.on_conflict_do_update(
+        index_elements=[DeviceCounter.software_name],
+        set_={
+            "total": DeviceCounter.total + stmt.excluded.total,
+            "authorized": DeviceCounter.authorized + stmt.excluded.authorized,
+        },
+    )
+
+
+@lru_cache(maxsize=None)
+def _replace_stmt(dialect_name: str):
+    """按软件名覆盖计数（对账使用）"""
+    if dialect_name == "mysql":
+        stmt = mysql_insert(DeviceCounter)
+        return stmt.on_duplicate_key_update(total=stmt.inserted.total, authorized=stmt.inserted.authorized)
+    stmt = sqlite_insert(DeviceCounter)
+    return stmt.on_conflict_do_update(
+        index_elements=[DeviceCounter.software_name],
+        set_={"total": stmt.excluded.total, "authorized": stmt.excluded.authorized},
+    )
+
+
+async def adjust_counters(db: AsyncSession, software_name: Optional[str], total: int = 0, authorized: int = 0):
+    """在当前事务中调整单个软件名的计数"""
+    delta = CounterDelta()
+    delta.add(software_name, total, authorized)
+    await delta.apply(db)
+
+
+async def read_counters(db: AsyncSession) -> Dict[str, Any]:
+    """读取计数：总数、已授权数、未授权数，以及按软件名的明细"""
+    result = await db.execute(
+        select(DeviceCounter.software_name, DeviceCounter.total, DeviceCounter.authorized)
+        .where(DeviceCounter.total != 0)
+        .order_by(DeviceCounter.software_name)
+    )
+    by_software = [
+        {
+            "software_name": row.software_name or None,
+            "total": row.total,
+            "authorized": row.authorized,
+            "unauthorized": row.total - row.authorized,
+        }
+        for row in result
+    ]
+    total = sum(item["total"] for item in by_software)
+    authorized = sum(item["authorized"] for item in by_software)
+    return {"total": total, "authorized": authorized, "unauthorized": total - authorized, "by_software": by_software}
+
+
+async def count_devices(db: AsyncSession, software_name: Optional[str] = None,
+                        is_authorized: Optional[bool] = None) -> int:
+    """设备数（读取计数器，不扫描 devices 表），可按软件名和授权状态筛选"""
+    if is_authorized is None:
+        value = DeviceCounter.total
+    elif is_authorized:
+        value = DeviceCounter.authorized
+    else:
+        value = DeviceCounter.total - DeviceCounter.authorized
+    query = select(func.coalesce(func.sum(value), 0))
+    if software_name is not None:
+        query = query.where(DeviceCounter.software_name == _counter_key(software_name))
+    return await db.scalar(query)
+
+
+async def _actual_counts(db: AsyncSession) -> Dict[str, Tuple[int, int]]:
+    result = await db.execute(
+        select(
+            Device.software_name,
+            func.count(),
+            func.sum(case((Device.is_authorized, 1), else_=0)),
+        ).group_by(Device.software_name)
+    )
+    actual: Dict[str, Tuple[int, int]] = {}
+    for software_name, total, authorized in result:
+        # NULL 与空字符串合并到同一个计数
+        key = _counter_key(software_name)
+        prev_total, prev_authorized = actual.get(key, (0, 0))
+        actual[key] = (prev_total + total, prev_authorized + int(authorized or 0))
+    return actual
+
+
+async def reconcile_counters(db: AsyncSession) -> int:
+    """按 devices 表重新统计并修正计数，返回修正的软件名数量"""
+    
+    async def write(session: AsyncSession) -> int:
+        # 先锁定计数行（MySQL 的 SELECT ... FOR UPDATE），再统计 devices 表：
+        # 并发的增量更新等待本事务提交后执行，统计和覆盖之间不会丢失
+        result = await session.execute(
+            select(DeviceCounter.software_name, DeviceCounter.total, DeviceCounter.authorized).with_for_update()
+        )
+        stored = {row.software_name: (row.total, row.authorized) for row in result}
+        actual = await _actual_counts(session)
+        fixes = [
+            {"software_name": name, "total": counts[0], "authorized": counts[1]}
+            for name, counts in actual.items()
+            if stored.get(name) != counts
+        ]
+        stale = [name for name in stored if name not in actual]
+        if fixes:
+            await session.execute(_replace_stmt(session.get_bind().dialect.name), fixes)
+        if stale:
+            await session.execute(delete(DeviceCounter).where(DeviceCounter.software_name.in_(stale)))
+        return len(fixes) + len(stale)
+    
+    corrected = await sqlite_writer.run(db, write)
+    if corrected:
+        logger.info(f"设备计数已对账，修正 {corrected} 个软件名的计数")
+    return corrected
+
+
+async def _reconcile():
+    async with AsyncSessionLocal() as db:
+        await reconcile_counters(db)
+
+
+counter_reconciler = PeriodicTask(
+    "device-counters-reconcile",
+    settings.device_counters_reconcile_interval,
+    _reconcile,
+)
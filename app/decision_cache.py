@@ -0,0 +1,147 @@
+"""
+心跳授权决策缓存
+
+按 device_id 缓存授权结果以及软件名/设备信息的指纹，
+心跳内容未变化时可以跳过数据库查询。容量有上限（LRU），条目带过期时间（TTL）。
+"""
+import hashlib
+import json
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import settings
+from app.models import Device
+
+
+class Decision(NamedTuple):
+    """缓存的授权决策"""
+    authorized: bool
+    software_hash: int
+    info_hash: int
+    expires_at: float
+
+    def matches(self, software_name: Optional[str], device_info: Optional[Dict[str, Any]]) -> bool:
+        """心跳内容是否与缓存一致（未传的字段视为不变）"""
+        if software_name is not None and text_hash(software_name) != self.software_hash:
+            return False
+        if device_info is not None and device_info_hash(device_info) != self.info_hash:
+            return False
+        return True
+
+
+def _hash64(data: bytes) -> int:
+    # 跨进程稳定的 64 位指纹（共享内存表需要），0 保留表示 None
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little") or 1
+
+
+def text_hash(value: Optional[str]) -> int:
+    """计算字符串指纹"""
+    if value is None:
+        return 0
+    return _hash64(value.encode("utf-8"))
+
+
+def device_info_hash(device_info: Optional[Dict[str, Any]]) -> int:
+    """计算设备信息的指纹"""
+    if device_info is None:
+        return 0
+    return _hash64(json.dumps(device_info, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode("utf-8"))
+
+
+class DecisionCache:
+    """有界 LRU + TTL 授权决策缓存（每个 worker 一份，仅在事件循环线程中访问）"""
+
+    shared = False
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Decision]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, device_id: str) -> Optional[Decision]:
+        entry = self._entries.get(device_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[device_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(device_id)
+        self.hits += 1
+        return entry
+
+    def put(self, device_id: str, authorized: bool, software_name: Optional[str],
+            device_info: Optional[Dict[str, Any]]):
+        self._entries[device_id] = Decision(
+            authorized, text_hash(software_name), device_info_hash(device_info), time.monotonic() + self.ttl
+        )
+        self._entries.move_to_end(device_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, device_id: str):
+        if self._entries.pop(device_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "shared": False,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+if settings.decision_cache_shared_path and sys.platform != "win32":
+    # 多 worker 共享同一张内存映射表，避免每个进程各自缓存、各自失效
+    from app.shared_table import SharedDecisionTable
+    decision_cache = SharedDecisionTable(
+        path=settings.decision_cache_shared_path,
+        slots=settings.decision_cache_size,
+        ttl=settings.decision_cache_ttl,
+    )
+else:
+    decision_cache = DecisionCache(
+        max_size=settings.decision_cache_size,
+        ttl=settings.decision_cache_ttl,
+    )
+
+
+async def preload_decisions(db: AsyncSession) -> int:
+    """启动时预热：按最近检查时间加载设备决策，返回加载数量"""
+    result = await db.execute(
+        select(Device.device_id, Device.is_authorized, Device.software_name, Device.device_info)
+        .order_by(Device.last_check.desc())
+        .limit(decision_cache.max_size)
+    )
+    rows = result.all()
+    # 从最久未检查的开始放入，最近活跃的设备位于 LRU 最新端
+    for row in reversed(rows):
+        decision_cache.put(row.device_id, row.is_authorized, row.software_name, row.device_info)
+    return len(rows)
@@ -0,0 +1,261 @@
+"""
+设备事件推送
+
+心跳和管理接口通过 publish() 发布设备事件（registered / touched / authorized / revoked / updated / deleted），
+发布只追加到内存缓冲，不在请求路径上分发。后台任务每 DEVICE_EVENTS_INTERVAL 秒把缓冲中的事件
+一次分发给所有订阅者（管理面板的 SSE 连接）：
+- touched 事件按时间窗口合并，一个窗口只推送一次；设备过多时只推送数量
+- 订阅者队列已满（客户端处理不过来）时丢弃积压，改为推送一次 resync，提示客户端重新加载
+
+多 worker 部署时设置 DEVICE_EVENTS_SOCKET_DIR：各 worker 在该目录下绑定 UNIX 数据报套接字，
+把本 worker 产生的事件广播给其他 worker，收到的事件在下一个窗口与本地事件一起分发。
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from app.database import settings
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# 合并后的 touched 事件最多携带的 device_id 数量，超过时只推送数量
+_TOUCHED_MAX_IDS = 1000
+# 单个数据报的最大字节数（超过时拆分）
+_DATAGRAM_MAX_SIZE = 60000
+
+
+class DeviceEventHub:
+    """设备事件的缓冲和分发（每个 worker 一份）"""
+
+    def __init__(self, interval: float, queue_size: int, socket_dir: str = ""):
+        self.queue_size = max(1, queue_size)
+        self.socket_dir = socket_dir if sys.platform != "win32" else ""
+        self._events: List[Dict[str, Any]] = []
+        self._touched: Set[str] = set()
+        self._remote_events: List[Dict[str, Any]] = []
+        self._remote_touched: Set[str] = set()
+        self._remote_touched_count = 0
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._socket: Optional[socket.socket] = None
+        self._socket_path = ""
+        self._task = PeriodicTask("device-events", interval, self.flush)
+
+    @property
+    def active(self) -> bool:
+        """是否需要记录事件（本 worker 有订阅者，或者需要广播给其他 worker）"""
+        return bool(self._subscribers) or self._socket is not None
+
+    def publish(self, event_type: str, device_id: str, **data: Any):
+        """发布单个设备事件（只写入缓冲，不阻塞调用方）"""
+        if not self.active:
+            return
+        if event_type == "touched":
+            self._touched.add(device_id)
+        else:
+            self._events.append({"type": event_type, "device_id": device_id, **data})
+
+    def publish_many(self, event_type: str, device_ids: List[str]):
+        """发布批量操作事件（一个事件携带多个 device_id）"""
+        if self.active and device_ids:
+            self._events.append({"type": event_type, "device_ids": device_ids, "count": len(device_ids)})
+
+    def publish_touched(self, device_ids):
+        """批量记录有心跳的设备"""
+        if self.active:
+            self._touched.update(device_ids)
+
+    def subscribe(self) -> asyncio.Queue:
+        """订阅事件，队列中的每一项是一批事件，None 表示服务正在关闭"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscribers),
+            "pending": len(self._events) + len(self._touched),
+            "broadcast": self._socket is not None,
+        }
+
+    def start(self):
+        if self.socket_dir and self._socket is None:
+            try:
+                self._open_socket()
+            except OSError as e:
+                logger.error(f"设备事件广播套接字创建失败，仅推送本 worker 的事件: {e}")
+        self._hook_exit_signals()
+        self._task.start()
+
+    async def stop(self):
+        """停止分发并通知所有订阅者结束"""
+        await self._task.stop(final_run=False)
+        self._close_socket()
+        self.close_subscribers()
+
+    def close_subscribers(self):
+        """通知所有订阅者结束事件流"""
+        for queue in list(self._subscribers):
+            self._drain(queue)
+            queue.put_nowait(None)
+
+    def _hook_exit_signals(self):
+        """
+        收到退出信号时立即结束事件流
+
+        uvicorn 收到退出信号后要等所有连接结束才执行 lifespan 的关闭流程，
+        事件流是长连接，不提前结束会让 worker 一直无法退出。
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            previous = signal.getsignal(sig)
+            if not callable(previous) or getattr(previous, "_device_events_hook", False):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(self.close_subscribers)
+                previous(signum, frame)
+
+            handler._device_events_hook = True
+            signal.signal(sig, handler)
+
+    async def flush(self) -> int:
+        """分发一个窗口内的事件，返回事件数"""
+        events, self._events = self._events, []
+        touched, self._touched = self._touched, set()
+        if self._socket is not None and (events or touched):
+            self._broadcast(events + ([self._touched_event(touched, len(touched))] if touched else []))
+
+        # 其他 worker 的 touched 与本地合并为一个事件（数量按各 worker 相加，可能略多于实际设备数）
+        batch, self._remote_events = self._remote_events + events, []
+        count = len(touched) + self._remote_touched_count
+        touched |= self._remote_touched
+        self._remote_touched, self._remote_touched_count = set(), 0
+        if count:
+            batch.append(self._touched_event(touched, count))
+        if batch and self._subscribers:
+            self._dispatch(batch)
+        return len(batch)
+
+    @staticmethod
+    def _touched_event(device_ids: Set[str], count: int) -> Dict[str, Any]:
+        event: Dict[str, Any] = {"type": "touched", "count": count, "last_check": datetime.now().isoformat()}
+        if count <= _TOUCHED_MAX_IDS:
+            event["device_ids"] = list(device_ids)
+        return event
+
+    def _dispatch(self, batch: List[Dict[str, Any]]):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(batch)
+            except asyncio.QueueFull:
+                # 客户端跟不上：丢弃积压，让它重新加载
+                self._drain(queue)
+                queue.put_nowait([{"type": "resync"}])
+
+    @staticmethod
+    def _drain(queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+
+    # ---- 多 worker 广播 ----
+
+    def _open_socket(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self._socket_path = os.path.join(self.socket_dir, f"{os.getpid()}.sock")
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self._socket_path)
+        sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._receive)
+        self._socket = sock
+
+    def _close_socket(self):
+        if self._socket is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        try:
+            os.unlink(self._socket_path)
+        except OSError:
+            pass
+
+    def _datagrams(self, events: List[Dict[str, Any]]):
+        """把事件编码为不超过 _DATAGRAM_MAX_SIZE 的数据报"""
+        chunk: List[bytes] = []
+        size = 2
+        for event in events:
+            data = json.dumps(event, ensure_ascii=False, default=str).encode("utf-8")
+            if chunk and size + len(data) + 1 > _DATAGRAM_MAX_SIZE:
+                yield b"[" + b",".join(chunk) + b"]"
+                chunk, size = [], 2
+            chunk.append(data)
+            size += len(data) + 1
+        if chunk:
+            yield b"[" + b",".join(chunk) + b"]"
+
+    def _broadcast(self, events: List[Dict[str, Any]]):
+        try:
+            peers = [name for name in os.listdir(self.socket_dir) if name.endswith(".sock")]
+        except OSError as e:
+            logger.warning(f"读取设备事件广播目录失败: {e}")
+            return
+        own = os.path.basename(self._socket_path)
+        datagrams = list(self._datagrams(events))
+        for name in peers:
+            if name == own:
+                continue
+            path = os.path.join(self.socket_dir, name)
+            try:
+                for data in datagrams:
+                    self._socket.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 对应的 worker 已退出，清理遗留的套接字文件
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                # 对方接收缓冲已满（BlockingIOError）等情况直接丢弃，不阻塞分发
+                logger.debug(f"设备事件广播到 {name} 失败: {e}")
+
+    def _receive(self):
+        while True:
+            try:
+                data = self._socket.recv(_DATAGRAM_MAX_SIZE + 1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.warning(f"接收设备事件广播失败: {e}")
+                return
+            try:
+                events = json.loads(data)
+            except ValueError:
+                continue
+            for event in events:
+                if event.get("type") == "touched":
+                    self._remote_touched.update(event.get("device_ids", ()))
+                    self._remote_touched_count += event.get("count", 0)
+                else:
+                    self._remote_events.append(event)
+
+
+device_events = DeviceEventHub(
+    interval=settings.device_events_interval,
+    queue_size=settings.device_events_queue_size,
+    socket_dir=settings.device_events_socket_dir,
+)
@@ -0,0 +1,206 @@
+"""
+密码哈希执行器
+
+sha256_crypt 每次校验要做几十万轮 SHA-256，直接在 async 路由中执行会阻塞整个 worker 的事件循环
+（包括心跳）。passlib 的 os_crypt 后端计算期间不释放 GIL，放到线程池同样会拖慢事件循环，
+因此哈希在独立的进程池中执行：
+- 并发数为 PASSWORD_HASH_WORKERS（进程数）
+- 排队数超过 PASSWORD_HASH_QUEUE_SIZE 时直接拒绝（503），不让登录请求无限堆积
+- 记录排队等待时间和哈希耗时（同时作为 password_hash_wait / password_hash 阶段写入 Prometheus 指标）
+- 哈希进程异常退出（如被 OOM killer 杀掉）导致进程池损坏时重建进程池并重试一次，仍失败则该请求返回 503
+
+设置 PASSWORD_HASH_TARGET_MS 后，启动时在哈希进程中实测本机速度，选出单次哈希耗时接近目标的轮数；
+登录成功时，轮数与目标相差较大的已有哈希会按新轮数重新生成（见 app/auth.py 的 authenticate_user）。
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.hash import sha256_crypt
+
+from app.database import settings
+from app.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# 校准时每个样本的轮数和样本数（取最快的一次）
+_CALIBRATION_ROUNDS = 50000
+_CALIBRATION_SAMPLES = 3
+# 轮数按该粒度取整；已有哈希的轮数与目标相差超过该比例才重新哈希，
+# 避免各 worker 校准结果略有差异时同一账号被反复重新哈希
+_ROUNDS_STEP = 1000
+_REHASH_TOLERANCE = 0.25
+
+
+def _run_verify(password: str, password_hash: str) -> Tuple[bool, float, float]:
+    started = time.time()
+    return sha256_crypt.verify(password, password_hash), started, time.time()
+
+
+def _run_hash(password: str, rounds: Optional[int]) -> Tuple[str, float, float]:
+    started = time.time()
+    hasher = sha256_crypt.using(rounds=rounds) if rounds else sha256_crypt
+    return hasher.hash(password), started, time.time()
+
+
+def _time_hash(rounds: int) -> float:
+    started = time.perf_counter()
+    sha256_crypt.using(rounds=rounds).hash("calibration")
+    return time.perf_counter() - started
+
+
+class _Timing:
+    """耗时统计（秒）"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        seconds = max(0.0, seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class PasswordHasher:
+    """有界的密码哈希进程池（每个 worker 一份）"""
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # 校准后的轮数，None 表示使用 passlib 默认值
+        self.rounds: Optional[int] = None
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.queue_wait = _Timing()
+        self.hash_time = _Timing()
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        """校验密码（哈希格式无法识别时返回 False）"""
+        try:
+            return await self._submit(_run_verify, password, password_hash)
+        except ValueError:
+            return False
+
+    async def hash(self, password: str) -> str:
+        """生成密码哈希（使用校准后的轮数）"""
+        return await self._submit(_run_hash, password, self.rounds)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """已有哈希的轮数是否与校准结果相差过大"""
+        if self.rounds is None:
+            return False
+        try:
+            rounds = sha256_crypt.from_string(password_hash).rounds
+        except ValueError:
+            return True
+        return abs(rounds - self.rounds) > self.rounds * _REHASH_TOLERANCE
+
+    async def calibrate(self, target_ms: float, min_rounds: int) -> int:
+        """按本机实测速度选择单次哈希耗时约为 target_ms 的轮数"""
+        elapsed = min([await self._run(_time_hash, _CALIBRATION_ROUNDS) for _ in range(_CALIBRATION_SAMPLES)])
+        rounds = round(_CALIBRATION_ROUNDS * target_ms / 1000 / elapsed / _ROUNDS_STEP) * _ROUNDS_STEP
+        self.rounds = max(min_rounds, sha256_crypt.min_rounds, min(rounds, sha256_crypt.max_rounds))
+        logger.info(f"密码哈希轮数已校准为 {self.rounds}（目标 {target_ms}ms）")
+        return self.rounds
+
+    async def _submit(self, func, *args) -> Any:
+        if self._in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="登录请求过多，请稍后重试",
+                headers={"Retry-After": "1"},
+            )
+        self._in_flight += 1
+        submitted = time.time()
+        try:
+            result, started, finished = await self._run(func, *args)
+        finally:
+            self._in_flight -= 1
+        self.completed += 1
+        self.queue_wait.add(started - submitted)
+        self.hash_time.add(finished - started)
+        observe_stage("password_hash_wait", started - submitted)
+        observe_stage("password_hash", finished - started)
+        return result
+
+    async def _run(self, func, *args) -> Any:
+        """在进程池中执行；进程池损坏时重建并重试一次"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            logger.warning("密码哈希进程池已损坏，重建后重试")
+            self._replace_executor(executor)
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            logger.error("密码哈希进程池重建后仍然损坏")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="密码哈希服务暂不可用，请稍后重试",
+                headers={"Retry-After": "1"},
+            )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn：不复制当前进程的事件循环、数据库连接等状态
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        """丢弃损坏的进程池（并发请求同时发现损坏时只重建一次）"""
+        with self._executor_lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "rounds": self.rounds,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "queue_wait": self.queue_wait.stats(),
+            "hash_time": self.hash_time.stats(),
+        }
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    queue_size=settings.password_hash_queue_size,
+)
@@ -0,0 +1,88 @@
+"""
+心跳写回缓冲（write-behind）
+
+只更新 last_check 的心跳不再逐个提交，而是在内存中按 device_id 合并，
+由后台任务按时间间隔或数量阈值批量写入数据库。
+"""
+import logging
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import bindparam, update
+
+from app.database import AsyncSessionLocal, settings
+from app.models import Device
+from app.sqlite_writer import sqlite_writer
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# 按 device_id 更新最后检查时间，配合参数列表做批量（executemany）更新；
+# 显式保留 change_version，不触发 onupdate 生成新的变更版本号
+touch_stmt = (
+    update(Device.__table__)
+    .where(Device.__table__.c.device_id == bindparam("b_device_id"))
+    .values(last_check=bindparam("b_last_check"), change_version=Device.__table__.c.change_version)
+)
+
+
+class HeartbeatBuffer:
+    """按设备合并的 last_check 写回缓冲（每个 worker 一份）"""
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_size = max(1, flush_size)
+        self._pending: Dict[str, datetime] = {}
+        self._task = PeriodicTask("heartbeat-flush", flush_interval, self.flush)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, device_id: str, checked_at: datetime):
+        """记录一次心跳，同一设备只保留最新时间"""
+        self._pending[device_id] = checked_at
+        if len(self._pending) >= self.flush_size:
+            self._task.wake()
+
+    def start(self):
+        self._task.start()
+
+    async def stop(self):
+        """停止后台任务并刷新剩余数据"""
+        await self._task.stop()
+
+    async def flush(self) -> int:
+        """将缓冲写入数据库，返回写入的设备数"""
+        if not self._pending:
+            return 0
+        # 先交换缓冲区，写入期间到达的心跳进入新缓冲
+        batch, self._pending = self._pending, {}
+        try:
+            await self._write(batch)
+        except Exception:
+            self._requeue(batch)
+            raise
+        return len(batch)
+
+    async def _write(self, batch: Dict[str, datetime]):
+        params = [{"b_device_id": k, "b_last_check": v} for k, v in batch.items()]
+        
+        async def write(session):
+            for i in range(0, len(params), self.flush_size):
+                await session.execute(touch_stmt, params[i:i + self.flush_size])
+        
+        async with AsyncSessionLocal() as db:
+            await sqlite_writer.run(db, write)
+
+    def _requeue(self, batch: Dict[str, datetime]):
+        """写入失败时放回缓冲，不覆盖期间产生的更新时间"""
+        for device_id, checked_at in batch.items():
+            current = self._pending.get(device_id)
+            if current is None or current < checked_at:
+                self._pending[device_id] = checked_at
+        logger.warning(f"心跳批量写入失败，{len(batch)} 条记录已放回缓冲")
+
+
+heartbeat_buffer = HeartbeatBuffer(
+    flush_interval=settings.heartbeat_flush_interval,
+    flush_size=settings.heartbeat_flush_size,
+)
@@ -0,0 +1,339 @@
+"""
+设备心跳历史
+
+心跳只在内存中按 (设备, 小时) 累加次数（HistoryRecorder），由后台任务按间隔批量写入 check_events：
+每个 (设备, 小时) 只有一行，各 worker 每次刷新时累加次数、取最后的心跳时间（upsert），
+不在请求路径上写库，也不增加 devices 表的写入。
+
+负责后台单例任务的 worker 定时把原始事件汇总为按小时、按天的设备桶和软件桶，并按保留期逐级降采样：
+原始事件 → 小时桶 → 天桶，保留期依次变长。汇总按整个小时 / 整天重算（先删后插），重复执行结果不变。
+"""
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, case, delete, func, insert, literal, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, settings
+from app.models import CheckEvent, Device, DeviceActivityBucket, SoftwareActivityBucket
+from app.sqlite_writer import sqlite_writer
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+HOUR = "hour"
+DAY = "day"
+# 每条 upsert 写入的事件行数
+_INSERT_CHUNK = 1000
+# 原始事件至少保留的小时数：最近已汇总的小时和前一个小时会被重算，需要原始事件仍然完整
+_MIN_RAW_RETENTION_HOURS = 3
+# 小时桶至少保留的天数：天桶由当天的小时桶汇总
+_MIN_HOURLY_RETENTION_DAYS = 2
+
+
+def _hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class HistoryRecorder:
+    """按 (设备, 小时) 合并的心跳历史缓冲（每个 worker 一份）"""
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_size = max(1, flush_size)
+        # (device_id, 小时) -> [软件名, 最后心跳时间, 次数]
+        self._pending: Dict[Tuple[str, datetime], list] = {}
+        self._task = PeriodicTask("check-history-flush", flush_interval, self.flush)
+        self.written = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, device_id: str, software_name: Optional[str], checked_at: datetime):
+        """记录一次心跳"""
+        key = (device_id, _hour(checked_at))
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [software_name, checked_at, 1]
+            if len(self._pending) >= self.flush_size:
+                self._task.wake()
+            return
+        if software_name is not None:
+            entry[0] = software_name
+        entry[1] = max(entry[1], checked_at)
+        entry[2] += 1
+
+    def start(self):
+        self._task.start()
+
+    async def stop(self):
+        """停止后台任务并写入剩余数据"""
+        await self._task.stop()
+
+    async def flush(self) -> int:
+        """将缓冲累加到 check_events（每个设备每小时一行），返回写入的行数"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        # 按主键顺序写入，减少多个 worker 同时刷新时 MySQL 的死锁
+        rows = [
+            {
+                "device_id": device_id,
+                "bucket": bucket,
+                "software_name": software_name,
+                "checked_at": checked_at,
+                "checks": checks,
+            }
+            for (device_id, bucket), (software_name, checked_at, checks) in sorted(batch.items())
+        ]
+        
+        async def write(session: AsyncSession):
+            stmt = _accumulate_stmt(session.get_bind().dialect.name)
+            for i in range(0, len(rows), _INSERT_CHUNK):
+                await session.execute(stmt, rows[i:i + _INSERT_CHUNK])
+        
+        try:
+            async with AsyncSessionLocal() as db:
+                await sqlite_writer.run(db, write)
+        except Exception:
+            self._requeue(batch)
+            raise
+        self.written += len(rows)
+        return len(rows)
+
+    def _requeue(self, batch: Dict[Tuple[str, datetime], list]):
+        """写入失败时合并回缓冲"""
+        for key, (software_name, checked_at, checks) in batch.items():
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [software_name, checked_at, checks]
+                continue
+            if entry[0] is None:
+                entry[0] = software_name
+            entry[1] = max(entry[1], checked_at)
+            entry[2] += checks
+        logger.warning(f"心跳历史写入失败，{len(batch)} 条记录已放回缓冲")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._pending), "written": self.written}
+
+
+@lru_cache(maxsize=None)
+def _accumulate_stmt(dialect_name: str):
+    """按 (设备, 小时) 累加心跳次数（不存在则插入）"""
+    if dialect_name == "mysql":
+        stmt = mysql_insert(CheckEvent)
+        new = stmt.inserted
+        return stmt.on_duplicate_key_update([
+            ("software_name", func.coalesce(new.software_name, CheckEvent.software_name)),
+            ("checked_at", case((new.checked_at > CheckEvent.checked_at, new.checked_at),
+                                else_=CheckEvent.checked_at)),
+            ("checks", CheckEvent.checks + new.checks),
+        ])
+    stmt = sqlite_insert(CheckEvent)
+    new = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[CheckEvent.device_id, CheckEvent.bucket],
+        set_={
+            "software_name": func.coalesce(new.software_name, CheckEvent.software_name),
+            "checked_at": case((new.checked_at > CheckEvent.checked_at, new.checked_at), else_=CheckEvent.checked_at),
+            "checks": CheckEvent.checks + new.checks,
+        },
+    )
+
+
+async def _replace_device_buckets(db: AsyncSession, granularity: str, start: datetime, end: datetime):
+    """重算一个小时 / 一天的设备桶：小时桶来自原始事件，天桶来自当天的小时桶"""
+    await db.execute(
+        delete(DeviceActivityBucket)
+        .where(DeviceActivityBucket.granularity == granularity, DeviceActivityBucket.bucket == start)
+    )
+    if granularity == HOUR:
+        # 心跳未携带软件名时使用设备当前的软件名
+        query = (
+            select(
+                literal(HOUR),
+                literal(start, DateTime),
+                CheckEvent.device_id,
+                func.coalesce(func.max(CheckEvent.software_name), func.max(Device.software_name), ""),
+                func.sum(CheckEvent.checks),
+                func.max(CheckEvent.checked_at),
+            )
+            .select_from(CheckEvent)
+            .outerjoin(Device, Device.device_id == CheckEvent.device_id)
+            .where(CheckEvent.checked_at >= start, CheckEvent.checked_at < end)
+            .group_by(CheckEvent.device_id)
+        )
+    else:
+        query = (
+            select(
+                literal(DAY),
+                literal(start, DateTime),
+                DeviceActivityBucket.device_id,
+                func.max(DeviceActivityBucket.software_name),
+                func.sum(DeviceActivityBucket.checks),
+                func.max(DeviceActivityBucket.last_check),
+            )
+            .where(
+                DeviceActivityBucket.granularity == HOUR,
+                DeviceActivityBucket.bucket >= start,
+                DeviceActivityBucket.bucket < end,
+            )
+            .group_by(DeviceActivityBucket.device_id)
+        )
+    await db.execute(
+        insert(DeviceActivityBucket).from_select(
+            ["granularity", "bucket", "device_id", "software_name", "checks", "last_check"], query
+        )
+    )
+
+
+async def _replace_software_buckets(db: AsyncSession, granularity: str, bucket: datetime):
+    """按设备桶重算软件桶"""
+    await db.execute(
+        delete(SoftwareActivityBucket)
+        .where(SoftwareActivityBucket.granularity == granularity, SoftwareActivityBucket.bucket == bucket)
+    )
+    await db.execute(
+        insert(SoftwareActivityBucket).from_select(
+            ["granularity", "bucket", "software_name", "checks", "devices"],
+            select(
+                literal(granularity),
+                literal(bucket, DateTime),
+                DeviceActivityBucket.software_name,
+                func.sum(DeviceActivityBucket.checks),
+                func.count(),
+            )
+            .where(DeviceActivityBucket.granularity == granularity, DeviceActivityBucket.bucket == bucket)
+            .group_by(DeviceActivityBucket.software_name),
+        )
+    )
+
+
+async def rollup_history(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """
+    把原始事件汇总为小时桶和天桶，返回重算的小时数
+
+    从最近一个已汇总小时的前一个小时开始重算（其他 worker 的缓冲可能在整点之后才写入上一小时的事件），
+    每个小时单独提交（经 SQLite 写入队列）；涉及的天按小时桶整体重算。
+    """
+    now = now or datetime.now()
+    latest = await db.scalar(
+        select(func.max(DeviceActivityBucket.bucket)).where(DeviceActivityBucket.granularity == HOUR)
+    )
+    if latest is not None:
+        start = latest - timedelta(hours=1)
+    else:
+        earliest = await db.scalar(select(func.min(CheckEvent.checked_at)))
+        if earliest is None:
+            return 0
+        start = _hour(earliest)
+    # 原始事件已被清理的小时不再重算，避免用不完整的数据覆盖已有的桶
+    retained = now - timedelta(hours=max(_MIN_RAW_RETENTION_HOURS, settings.check_history_raw_retention_hours))
+    start = max(start, _hour(retained) + timedelta(hours=1))
+    
+    async def replace(granularity: str, start: datetime, end: datetime):
+        async def write(session: AsyncSession):
+            await _replace_device_buckets(session, granularity, start, end)
+            await _replace_software_buckets(session, granularity, start)
+        
+        await sqlite_writer.run(db, write)
+    
+    hours = 0
+    days = set()
+    hour = start
+    while hour <= now:
+        await replace(HOUR, hour, hour + timedelta(hours=1))
+        days.add(_day(hour))
+        hours += 1
+        hour += timedelta(hours=1)
+    for day in sorted(days):
+        await replace(DAY, day, day + timedelta(days=1))
+    return hours
+
+
+async def prune_history(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """按保留期清理原始事件、小时桶和天桶，返回删除的行数"""
+    now = now or datetime.now()
+    raw_cutoff = now - timedelta(hours=max(_MIN_RAW_RETENTION_HOURS, settings.check_history_raw_retention_hours))
+    hourly_cutoff = now - timedelta(
+        days=max(_MIN_HOURLY_RETENTION_DAYS, settings.check_history_hourly_retention_days)
+    )
+    daily_cutoff = now - timedelta(days=settings.check_history_daily_retention_days)
+    
+    async def write(session: AsyncSession) -> int:
+        deleted = (await session.execute(delete(CheckEvent).where(CheckEvent.checked_at < raw_cutoff))).rowcount
+        for model in (DeviceActivityBucket, SoftwareActivityBucket):
+            for granularity, cutoff in ((HOUR, hourly_cutoff), (DAY, daily_cutoff)):
+                result = await session.execute(
+                    delete(model).where(model.granularity == granularity, model.bucket < cutoff)
+                )
+                deleted += result.rowcount
+        return deleted
+    
+    deleted = await sqlite_writer.run(db, write)
+    if deleted:
+        logger.info(f"已清理 {deleted} 条过期的心跳历史")
+    return deleted
+
+
+async def read_device_activity(db: AsyncSession, device_id: str, granularity: str,
+                               since: datetime) -> List[Dict[str, Any]]:
+    """读取设备的心跳桶（按时间升序）"""
+    result = await db.execute(
+        select(DeviceActivityBucket.bucket, DeviceActivityBucket.checks, DeviceActivityBucket.last_check)
+        .where(
+            DeviceActivityBucket.device_id == device_id,
+            DeviceActivityBucket.granularity == granularity,
+            DeviceActivityBucket.bucket >= since,
+        )
+        .order_by(DeviceActivityBucket.bucket)
+    )
+    return [{"bucket": row.bucket, "checks": row.checks, "last_check": row.last_check} for row in result]
+
+
+async def read_software_activity(db: AsyncSession, granularity: str, since: datetime,
+                                 software_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """读取软件的心跳桶（按时间、软件名升序），可只读取一个软件"""
+    query = (
+        select(
+            SoftwareActivityBucket.bucket,
+            SoftwareActivityBucket.software_name,
+            SoftwareActivityBucket.checks,
+            SoftwareActivityBucket.devices,
+        )
+        .where(SoftwareActivityBucket.granularity == granularity, SoftwareActivityBucket.bucket >= since)
+        .order_by(SoftwareActivityBucket.bucket, SoftwareActivityBucket.software_name)
+    )
+    if software_name is not None:
+        query = query.where(SoftwareActivityBucket.software_name == software_name)
+    result = await db.execute(query)
+    return [
+        {
+            "bucket": row.bucket,
+            "software_name": row.software_name or None,
+            "checks": row.checks,
+            "devices": row.devices,
+        }
+        for row in result
+    ]
+
+
+async def _rollup():
+    async with AsyncSessionLocal() as db:
+        await rollup_history(db)
+        await prune_history(db)
+
+
+check_history = HistoryRecorder(
+    flush_interval=settings.check_history_flush_interval,
+    flush_size=settings.heartbeat_flush_size,
+)
+history_rollup = PeriodicTask("check-history-rollup", settings.check_history_rollup_interval, _rollup)
@@ -0,0 +1,225 @@
+"""
+Prometheus 指标
+
+GET /metrics 以 Prometheus 文本格式输出：
+- 按路由模板的请求耗时直方图（到响应头发出为止，流式响应和事件流不包括传输时间）
+- 心跳热点路径各阶段耗时：Fernet / AES-GCM 解密和加密、设备查询、提交、密码哈希
+- 新设备 / 老设备 / 归档恢复的心跳数、解密失败数、授权结果
+- 连接池已借出的连接数和溢出连接数
+
+多 worker 部署时设置 METRICS_MULTIPROC_DIR（如 /dev/shm/py_auth_metrics），各 worker 把指标写入该目录下的
+内存映射文件，任意 worker 收到抓取请求时汇总所有 worker 的数据（prometheus_client 的 multiprocess 模式）。
+未设置时只输出当前 worker 的指标。指标只使用带标签的形式，哈希进程池等子进程导入本模块时不会创建指标文件。
+"""
+import logging
+import os
+import re
+import time
+from typing import Iterable
+
+from app.database import async_engine, replica_engine, settings
+
+# multiprocess 模式需在导入 prometheus_client 之前设置目录
+if settings.metrics_multiproc_dir:
+    os.makedirs(settings.metrics_multiproc_dir, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = settings.metrics_multiproc_dir
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from sqlalchemy import event  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import Response  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+# 阶段耗时的桶（秒）：加解密在微秒级，提交和密码哈希在毫秒到秒级
+_STAGE_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+# 指标文件名中的进程号，如 histogram_1234.db、gauge_livesum_1234.db
+_PID_FILE = re.compile(r"_(\d+)\.db$")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "py_auth_http_request_duration_seconds",
+    "请求耗时（到响应头发出为止）",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "py_auth_stage_duration_seconds",
+    "心跳、登录等热点路径各阶段的耗时",
+    ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+HEARTBEAT_DEVICES = Counter(
+    "py_auth_heartbeat_devices_total",
+    "按设备类型统计的心跳数（new：新设备，returning：已有设备，restored：从归档恢复）",
+    ["kind"],
+)
+DECRYPT_FAILURES = Counter(
+    "py_auth_decrypt_failures_total",
+    "心跳请求解密失败数",
+    ["protocol"],
+)
+AUTHORIZATION_DECISIONS = Counter(
+    "py_auth_authorization_decisions_total",
+    "心跳授权结果（rejected：请求无法解密）",
+    ["result"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "py_auth_db_pool_checked_out",
+    "连接池已借出的连接数",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "py_auth_db_pool_overflow",
+    "连接池超出 pool_size 的溢出连接数",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+
+
+def time_stage(stage: str):
+    """阶段计时（上下文管理器）"""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def observe_stage(stage: str, seconds: float):
+    """记录已测得的阶段耗时"""
+    STAGE_SECONDS.labels(stage).observe(max(0.0, seconds))
+
+
+def count_devices(kind: str, count: int = 1):
+    if count:
+        HEARTBEAT_DEVICES.labels(kind).inc(count)
+
+
+def count_decisions(decisions: Iterable[bool]):
+    """按授权结果计数"""
+    authorized = unauthorized = 0
+    for decision in decisions:
+        if decision:
+            authorized += 1
+        else:
+            unauthorized += 1
+    if authorized:
+        AUTHORIZATION_DECISIONS.labels("authorized").inc(authorized)
+    if unauthorized:
+        AUTHORIZATION_DECISIONS.labels("unauthorized").inc(unauthorized)
+
+
+class MetricsMiddleware:
+    """记录每个请求的耗时，按路由模板（而不是实际路径）作为标签，避免标签数量随 device_id 增长"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status_code: int):
+            nonlocal recorded
+            recorded = True
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "<unmatched>"), str(status_code)
+            ).observe(time.perf_counter() - started)
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start" and not recorded:
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            if not recorded:
+                record(500)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """输出 Prometheus 文本格式的指标"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def _instrument_pool(engine, name: str):
+    """连接借出 / 归还时更新连接池指标（SQLite 的 NullPool / StaticPool 等没有这些统计，跳过）"""
+    sync_engine = engine.sync_engine
+    if not hasattr(sync_engine.pool, "checkedout"):
+        return
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+    overflow = DB_POOL_OVERFLOW.labels(name)
+
+    def on_checkout(*args):
+        # 引擎 dispose 后连接池会重建，每次读取当前的连接池
+        pool = sync_engine.pool
+        checked_out.set(pool.checkedout())
+        overflow.set(max(0, pool.overflow()))
+
+    def on_checkin(*args):
+        # checkin 事件在连接放回连接池之前触发：按放回之后的状态计算（空闲队列已满时溢出连接会被关闭）
+        pool = sync_engine.pool
+        checked_out.set(max(0, pool.checkedout() - 1))
+        overflow.set(max(0, pool.overflow() - (1 if pool.checkedin() >= pool.size() else 0)))
+
+    event.listen(sync_engine, "checkout", on_checkout)
+    event.listen(sync_engine, "checkin", on_checkin)
+
+
+def setup_metrics(app):
+    """
+    配置指标中间件、GET /metrics 和连接池指标（METRICS_ENABLED=false 时不启用）
+
+    Args:
+        app: FastAPI应用实例
+    """
+    if not settings.metrics_enabled:
+        return
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    _instrument_pool(async_engine, "primary")
+    if replica_engine is not None:
+        _instrument_pool(replica_engine, "replica")
+
+
+def cleanup_multiprocess_dir():
+    """删除已退出进程遗留的指标文件（由执行初始化的 worker 在启动时调用）"""
+    if not MULTIPROC_DIR:
+        return
+    removed = 0
+    for name in os.listdir(MULTIPROC_DIR):
+        match = _PID_FILE.search(name)
+        if match is None:
+            continue
+        try:
+            os.kill(int(match.group(1)), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            # 进程存在但属于其他用户
+            continue
+        try:
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info(f"已清理 {removed} 个已退出 worker 的指标文件")
+
+
+def mark_process_dead():
+    """worker 退出时移除其 livesum 等实时指标，其他 worker 汇总时不再计入"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
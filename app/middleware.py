@@ -2,6 +2,9 @@
 中间件配置
 """
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from app.database import READ_PRIMARY_COOKIE, replica_engine, settings
+import math
 
 def setup_cors(app):
     """
@@ -23,3 +26,49 @@ def setup_cors(app):
         allow_headers=["*"],
     )
 
+def setup_gzip(app):
+    """
+    配置响应压缩（较大的设备列表等响应使用 gzip）
+    
+    Args:
+        app: FastAPI应用实例
+    """
+    if settings.gzip_minimum_size > 0:
+        app.add_middleware(GZipMiddleware, minimum_size=settings.gzip_minimum_size, compresslevel=6)
+
+class ReadYourWritesMiddleware:
+    """
+    管理端修改数据成功后设置短期 cookie，之后该客户端的只读查询改读主库
+    
+    副本存在复制延迟，刚授权 / 删除设备后立即刷新列表可能读到旧数据；cookie 过期后恢复读副本。
+    """
+    
+    def __init__(self, app, max_age: float):
+        self.app = app
+        self.cookie = (
+            f"{READ_PRIMARY_COOKIE}=1; Max-Age={max(1, math.ceil(max_age))}; "
+            "Path=/api/admin; HttpOnly; SameSite=Strict"
+        ).encode("latin-1")
+    
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS")
+                or not scope["path"].startswith("/api/admin/")):
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", self.cookie)]}
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cookie)
+
+def setup_read_your_writes(app):
+    """
+    配置只读副本的 read-your-writes（未配置副本时不启用）
+    
+    Args:
+        app: FastAPI应用实例
+    """
+    if replica_engine is not None:
+        app.add_middleware(ReadYourWritesMiddleware, max_age=settings.replica_read_your_writes_seconds)
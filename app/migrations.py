@@ -0,0 +1,41 @@
+"""
+轻量表结构升级
+
+create_all 只会创建缺失的表，已有表新增的列和索引不会自动补上。
+这里对比模型定义和数据库现状，补齐缺失的列（均为可空列或生成列）和索引。
+"""
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+
+from app.database import Base
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema(engine: Engine):
+    """为已存在的表补齐新增的列和索引"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if column.computed is not None:
+                    # 生成列由数据库按表达式计算，已有行无需回填
+                    definition = CreateColumn(column).compile(dialect=engine.dialect)
+                else:
+                    definition = f"{column.name} {column.type.compile(dialect=engine.dialect)} NULL"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+                logger.info(f"已添加列 {table.name}.{column.name}")
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=conn)
+                    logger.info(f"已创建索引 {index.name}")
@@ -1,7 +1,40 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, JSON, Index, Computed, column, func
 from datetime import datetime
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import time
 from app.database import Base
 
+
+def device_info_digest(device_info: Optional[Dict[str, Any]]) -> Optional[str]:
+    """计算设备信息的内容摘要（与键顺序无关），用于判断 device_info 是否变化"""
+    if device_info is None:
+        return None
+    canonical = json.dumps(device_info, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+_last_change_version = 0
+
+
+def next_change_version() -> int:
+    """
+    生成设备变更版本号：微秒时间戳，在进程内严格递增
+
+    多个 worker 之间不需要共享计数器；读取变更时只返回早于“当前时间 - 稳定窗口”的版本，
+    避免遗漏其他 worker 稍后才提交的较小版本号。
+    """
+    global _last_change_version
+    _last_change_version = max(time.time_ns() // 1000, _last_change_version + 1)
+    return _last_change_version
+
+
+def _device_info_field(key: str, length: int) -> Computed:
+    """从 device_info 提取单个字段的生成列（表达式按 SQLite / MySQL 方言分别编译）"""
+    return Computed(func.substr(column("device_info", JSON)[key].as_string(), 1, length))
+
+
 class Device(Base):
     __tablename__ = "devices"
     
@@ -9,16 +42,148 @@ class Device(Base):
     device_id = Column(String(255), unique=True, index=True, nullable=False)
     software_name = Column(String(255), nullable=True)  # 软件名
     device_info = Column(JSON, nullable=True)  # 设备信息（JSON格式，包含hostname等）
+    device_info_digest = Column(String(32), nullable=True)  # 设备信息摘要，未变化时跳过 device_info 写入
     remark = Column(Text, nullable=True)  # 备注
     is_authorized = Column(Boolean, default=True, nullable=False)  # 默认授权
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     last_check = Column(DateTime, nullable=True)
+    # 从 device_info 提取的生成列，用于按主机名、IP、MAC 过滤和排序
+    hostname = Column(String(255), _device_info_field("hostname", 255), index=True)
+    ip_address = Column(String(64), _device_info_field("ip_address", 64), index=True)
+    mac_address = Column(String(64), _device_info_field("mac_address", 64), index=True)
+    # 变更版本号：插入和更新时自动生成；只刷新 last_check 的心跳写入显式保留原值（touch_stmt、upsert），
+    # 设备状态（软件名、设备信息、授权状态、备注）未变化时增量同步和列表 ETag 不受心跳影响
+    change_version = Column(BigInteger, default=next_change_version, onupdate=next_change_version, index=True)
+    
+    __table_args__ = (
+        # 设备列表按 (updated_at, id) 降序分页
+        Index("ix_devices_updated_at_id", "updated_at", "id"),
+        # 按软件名 / 授权状态过滤后按更新时间排序
+        Index("ix_devices_software_updated", "software_name", "updated_at"),
+        Index("ix_devices_authorized_updated", "is_authorized", "updated_at"),
+        # 按软件名 + 授权状态过滤并按最后检查时间范围查询
+        Index("ix_devices_software_authorized_check", "software_name", "is_authorized", "last_check"),
+        Index("ix_devices_last_check", "last_check"),
+    )
     
     def __repr__(self):
         return f"<Device(id={self.id}, device_id={self.device_id}, authorized={self.is_authorized})>"
 
 
+class ArchivedDevice(Base):
+    """长期未心跳的设备（冷数据），从 devices 表移入；设备再次心跳时移回 devices 表"""
+    __tablename__ = "archived_devices"
+    
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String(255), unique=True, index=True, nullable=False)
+    software_name = Column(String(255), nullable=True)
+    device_info = Column(JSON, nullable=True)
+    device_info_digest = Column(String(32), nullable=True)
+    remark = Column(Text, nullable=True)
+    is_authorized = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    last_check = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.now, nullable=False)
+    
+    def __repr__(self):
+        return f"<ArchivedDevice(device_id={self.device_id}, authorized={self.is_authorized})>"
+
+
+class DeviceTombstone(Base):
+    """已删除设备的墓碑，供增量同步通知客户端删除（超过保留期后清理）"""
+    __tablename__ = "device_tombstones"
+    
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String(255), nullable=False)
+    change_version = Column(BigInteger, default=next_change_version, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.now, nullable=False)
+    
+    def __repr__(self):
+        return f"<DeviceTombstone(device_id={self.device_id}, change_version={self.change_version})>"
+
+
+class DeviceCounter(Base):
+    """按软件名增量维护的设备计数（软件名为空的设备记在空字符串下）"""
+    __tablename__ = "device_counters"
+    
+    software_name = Column(String(255), primary_key=True)
+    total = Column(Integer, default=0, nullable=False)  # 设备总数
+    authorized = Column(Integer, default=0, nullable=False)  # 已授权设备数
+    
+    def __repr__(self):
+        return f"<DeviceCounter(software_name={self.software_name}, total={self.total}, authorized={self.authorized})>"
+
+
+class SoftwareActivity(Base):
+    """按软件名统计的活跃设备数快照（最近 hours 小时内有心跳），由后台任务定时刷新"""
+    __tablename__ = "software_activity"
+    
+    software_name = Column(String(255), primary_key=True)  # 软件名为空的设备记在空字符串下
+    hours = Column(Integer, primary_key=True)  # 统计窗口（小时）
+    active = Column(Integer, default=0, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f"<SoftwareActivity(software_name={self.software_name}, hours={self.hours}, active={self.active})>"
+
+
+class CheckEvent(Base):
+    """设备心跳历史：同一设备每小时一行，各 worker 刷新时累加次数，超过保留期后清理"""
+    __tablename__ = "check_events"
+    
+    # SQLite 只有 INTEGER PRIMARY KEY 才会自增
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    device_id = Column(String(255), nullable=False)
+    software_name = Column(String(255), nullable=True)  # 心跳携带的软件名，未携带时为空
+    # 所在小时的起始时间（升级前写入的行为空，不参与唯一约束）
+    bucket = Column(DateTime, nullable=True)
+    checked_at = Column(DateTime, nullable=False)  # 该小时内最后一次心跳时间
+    checks = Column(Integer, default=1, nullable=False)  # 该小时内的心跳次数
+    
+    __table_args__ = (
+        Index("ix_check_events_checked_at", "checked_at"),
+        Index("ux_check_events_device_bucket", "device_id", "bucket", unique=True),
+    )
+    
+    def __repr__(self):
+        return f"<CheckEvent(device_id={self.device_id}, checked_at={self.checked_at}, checks={self.checks})>"
+
+
+class DeviceActivityBucket(Base):
+    """按设备汇总的心跳次数（granularity 为 hour 或 day，bucket 为该小时 / 天的起始时间）"""
+    __tablename__ = "device_activity_buckets"
+    
+    granularity = Column(String(8), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    device_id = Column(String(255), primary_key=True)
+    software_name = Column(String(255), nullable=False)  # 软件名为空的设备记在空字符串下
+    checks = Column(Integer, default=0, nullable=False)
+    last_check = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_device_activity_device_bucket", "device_id", "granularity", "bucket"),
+    )
+    
+    def __repr__(self):
+        return f"<DeviceActivityBucket(device_id={self.device_id}, {self.granularity}={self.bucket}, checks={self.checks})>"
+
+
+class SoftwareActivityBucket(Base):
+    """按软件名汇总的心跳次数和活跃设备数（由设备汇总计算）"""
+    __tablename__ = "software_activity_buckets"
+    
+    granularity = Column(String(8), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    software_name = Column(String(255), primary_key=True)  # 软件名为空的设备记在空字符串下
+    checks = Column(Integer, default=0, nullable=False)
+    devices = Column(Integer, default=0, nullable=False)  # 有心跳的设备数
+    
+    def __repr__(self):
+        return f"<SoftwareActivityBucket(software_name={self.software_name}, {self.granularity}={self.bucket}, devices={self.devices})>"
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -27,6 +192,8 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
+    # 凭据版本号：修改密码或禁用时递增，之前签发的令牌随之失效（旧库补列后为 NULL，按 0 处理）
+    credential_version = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
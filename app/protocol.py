@@ -0,0 +1,88 @@
+"""
+心跳协议 v2：AES-GCM + 紧凑二进制负载
+
+v1 为 Fernet（AES-CBC + HMAC）→ base64 → JSON 信封，消息经过两次 base64 膨胀和两次 JSON 编解码。
+v2 直接以原始请求体发送，格式为：
+
+    版本(1) | nonce(12) | AES-GCM(负载) + tag(16)
+
+附加认证数据（AAD）为 版本 + 方向（请求 b"Q" / 响应 b"R"），防止把请求当作响应重放。
+
+请求负载：
+    flags(1) | len(2) device_id | [len(2) software_name] | [len(4) device_info 紧凑 JSON]
+    flags bit0 表示携带 software_name，bit1 表示携带 device_info
+
+响应负载：
+    flags(1)，bit0 表示已授权
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+from typing import Any, Dict, Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.auth import CLIENT_SECRET
+from app.metrics import DECRYPT_FAILURES, time_stage
+
+logger = logging.getLogger(__name__)
+
+V2_CONTENT_TYPE = "application/x-py-auth-v2"
+V2_VERSION = 2
+
+_NONCE_SIZE = 12
+_HAS_SOFTWARE_NAME = 0x01
+_HAS_DEVICE_INFO = 0x02
+_AUTHORIZED = 0x01
+_AAD_REQUEST = bytes([V2_VERSION]) + b"Q"
+_AAD_RESPONSE = bytes([V2_VERSION]) + b"R"
+
+_aead = None
+
+
+def _get_aead() -> Optional[AESGCM]:
+    """获取 AES-GCM 加密器（密钥与 v1 的 Fernet 密钥分开派生）"""
+    global _aead
+    if _aead is None and CLIENT_SECRET:
+        key = hashlib.sha256(b"py-auth-v2:" + CLIENT_SECRET.encode("utf-8")).digest()
+        _aead = AESGCM(key)
+    return _aead
+
+
+def decode_request(body: bytes) -> Optional[Dict[str, Any]]:
+    """解密并解析 v2 心跳请求，失败返回 None"""
+    aead = _get_aead()
+    if not aead or len(body) < 1 + _NONCE_SIZE or body[0] != V2_VERSION:
+        return None
+    try:
+        with time_stage("aesgcm_decrypt"):
+            payload = aead.decrypt(body[1:1 + _NONCE_SIZE], body[1 + _NONCE_SIZE:], _AAD_REQUEST)
+        flags = payload[0]
+        (length,) = struct.unpack_from(">H", payload, 1)
+        offset = 3 + length
+        data: Dict[str, Any] = {"device_id": payload[3:offset].decode("utf-8")}
+        if flags & _HAS_SOFTWARE_NAME:
+            (length,) = struct.unpack_from(">H", payload, offset)
+            data["software_name"] = payload[offset + 2:offset + 2 + length].decode("utf-8")
+            offset += 2 + length
+        if flags & _HAS_DEVICE_INFO:
+            (length,) = struct.unpack_from(">I", payload, offset)
+            data["device_info"] = json.loads(payload[offset + 4:offset + 4 + length])
+        return data
+    except Exception as e:
+        DECRYPT_FAILURES.labels("v2").inc()
+        logger.error(f"v2 解密失败: {e}")
+        return None
+
+
+def encode_response(authorized: bool) -> Optional[bytes]:
+    """加密 v2 心跳响应"""
+    aead = _get_aead()
+    if not aead:
+        return None
+    nonce = os.urandom(_NONCE_SIZE)
+    payload = bytes([_AUTHORIZED if authorized else 0])
+    with time_stage("aesgcm_encrypt"):
+        return bytes([V2_VERSION]) + nonce + aead.encrypt(nonce, payload, _AAD_RESPONSE)
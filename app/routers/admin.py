@@ -1,50 +1,396 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
+from sqlalchemy import String, and_, cast, delete, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import OperationalError
-from datetime import datetime
-from app.database import get_db
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Literal, Optional, Tuple
+import asyncio
+import base64
+import json
+from app.database import get_db, get_read_db, read_session_factory, settings
 from app.models import Device, User
-from app.schemas import DeviceResponse, DeviceUpdate
+from app.schemas import DeviceBulkRequest, DeviceFilter, DeviceResponse, DeviceUpdate
 from app.auth import get_current_user
+from app.bulk import bulk_delete, bulk_set_authorized
+from app.changes import add_tombstones, change_marker, make_etag, read_changes
+from app.counters import adjust_counters, count_devices, read_counters
+from app.stats import read_stats
+from app.decision_cache import decision_cache
+from app.events import device_events
+from app.hashing import password_hasher
+from app.heartbeat_buffer import heartbeat_buffer
+from app.history import check_history, read_device_activity, read_software_activity
+from app.sqlite_writer import sqlite_writer
+from app.token_cache import token_cache
+from app.transfer import ExportFormat, export_devices, import_devices
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/admin", tags=["管理"])
 
+# 设备列表只查询需要的列，不加载 ORM 对象
+_DEVICE_LIST_COLUMNS = (
+    Device.id,
+    Device.device_id,
+    Device.software_name,
+    Device.remark,
+    Device.is_authorized,
+    Device.created_at,
+    Device.updated_at,
+    Device.last_check,
+    Device.hostname,
+    Device.ip_address,
+    Device.mac_address,
+    Device.change_version,
+)
+# 可排序的列（均有索引，排序时以 id 作为第二排序键）
+_SORT_COLUMNS = {
+    "updated_at": Device.updated_at,
+    "last_check": Device.last_check,
+    "software_name": Device.software_name,
+    "is_authorized": Device.is_authorized,
+    "hostname": Device.hostname,
+    "ip_address": Device.ip_address,
+    "mac_address": Device.mac_address,
+}
+# 计数器可以直接给出总数的过滤条件
+_COUNTER_FILTERS = {"software_name", "is_authorized"}
+# 未携带设备信息时列中可能是 SQL NULL，也可能是 JSON null
+_HAS_DEVICE_INFO = and_(
+    Device.device_info.isnot(None), cast(Device.device_info, String) != "null"
+).label("has_device_info")
+# device_info=summary 时保留的字段数和字符串长度
+_SUMMARY_MAX_FIELDS = 8
+_SUMMARY_MAX_LENGTH = 64
+# 增量同步单次最多返回的变更数
+_CHANGES_MAX_LIMIT = 1000
+# 事件流没有事件时发送保活注释的间隔（秒），避免代理断开空闲连接
+_EVENTS_KEEPALIVE = 15.0
 
-def get_device_or_404(device_id: str, db: Session) -> Device:
+
+async def get_device_or_404(device_id: str, db: AsyncSession) -> Device:
     """获取设备，不存在则抛出404异常"""
-    device = db.query(Device).filter(Device.device_id == device_id).first()
+    result = await db.execute(select(Device).where(Device.device_id == device_id))
+    device = result.scalars().first()
     if not device:
         raise HTTPException(status_code=404, detail="设备不存在")
     return device
 
+def encode_cursor(sort: str, order: str, value: Any, device_id: int) -> str:
+    """把分页位置（排序列的值, id）连同排序方式编码为不透明的游标"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, order, value, device_id], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[Any, int]:
+    """解析游标，格式错误或与当前排序方式不一致时抛出 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, device_id = json.loads(raw)
+        if (cursor_sort, cursor_order) != (sort, order):
+            raise ValueError(cursor_sort)
+        if value is not None and _SORT_COLUMNS[sort].type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        return value, int(device_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+
+def _filter_conditions(filters: DeviceFilter) -> List[Any]:
+    """过滤条件（空字符串视为未设置）"""
+    conditions = []
+    for name in ("software_name", "hostname", "ip_address", "mac_address"):
+        value = getattr(filters, name)
+        if value:
+            conditions.append(getattr(Device, name) == value)
+    if filters.is_authorized is not None:
+        conditions.append(Device.is_authorized == filters.is_authorized)
+    if filters.last_check_from is not None:
+        conditions.append(Device.last_check >= filters.last_check_from)
+    if filters.last_check_to is not None:
+        conditions.append(Device.last_check < filters.last_check_to)
+    return conditions
+
+
+async def _count_filtered(db: AsyncSession, filters: DeviceFilter, conditions: List[Any]) -> int:
+    """过滤后的总数：只按软件名 / 授权状态过滤时读取计数器，否则走索引 count"""
+    used = {name for name, value in filters.model_dump().items() if value not in (None, "")}
+    if used <= _COUNTER_FILTERS:
+        return await count_devices(db, filters.software_name or None, filters.is_authorized)
+    return await db.scalar(select(func.count()).select_from(Device).where(*conditions))
+
+
+def _after_cursor(query, sort_column, descending: bool, value: Any, last_id: int) -> List[Any]:
+    """
+    游标之后的查询，依次执行直到取满一页
+
+    行值比较可以直接在 (排序列, id) 索引上定位。SQLite 和 MySQL 都把 NULL 排在最小：
+    降序时排序列为空的行在最后，升序时在最前，这部分行单独按 id 继续。
+    """
+    nulls = query.where(sort_column.is_(None))
+    if value is None:
+        queries = [nulls.where(Device.id < last_id if descending else Device.id > last_id)]
+        if not descending:
+            queries.append(query.where(sort_column.isnot(None)))
+        return queries
+    position = tuple_(sort_column, Device.id)
+    queries = [query.where(position < tuple_(value, last_id) if descending else position > tuple_(value, last_id))]
+    if descending:
+        queries.append(nulls)
+    return queries
+
+
+def _summarize_device_info(device_info: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """截断设备信息：只保留前几个标量字段，过长的字符串截断"""
+    if not isinstance(device_info, dict):
+        return device_info
+    summary = {}
+    for key, value in device_info.items():
+        if len(summary) >= _SUMMARY_MAX_FIELDS:
+            break
+        if isinstance(value, (dict, list)):
+            continue
+        if isinstance(value, str) and len(value) > _SUMMARY_MAX_LENGTH:
+            value = value[:_SUMMARY_MAX_LENGTH] + "…"
+        summary[key] = value
+    return summary
+
+
 @router.get("/devices")
 async def get_devices(
-    page: int = 1,
-    page_size: int = 10,
-    db: Session = Depends(get_db),
+    request: Request,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1),
+    cursor: Optional[str] = None,
+    device_info: Literal["full", "summary", "none"] = "full",
+    sort: Literal["updated_at", "last_check", "software_name", "is_authorized",
+                  "hostname", "ip_address", "mac_address"] = "updated_at",
+    order: Literal["asc", "desc"] = "desc",
+    filters: DeviceFilter = Depends(),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取设备列表（需要登录），默认按更新时间降序排列
+    
+    过滤：software_name、is_authorized、last_check_from / last_check_to、
+    hostname、ip_address、mac_address（后三项从设备信息中提取，精确匹配）。
+    排序：sort 指定排序列，order 指定升序或降序，相同值按 id 排序。
+    
+    分页方式：
+    - page/page_size：按页码分页（OFFSET），页码越大越慢
+    - cursor：游标分页，传入上一页返回的 next_cursor（空字符串表示第一页），
+      使用 (排序列, id) 索引定位，任意深度的翻页耗时相同；游标与排序方式绑定
+    
+    两种方式都会返回 next_cursor，没有下一页时为 null。
+    
+    响应带 ETag（由设备最新变更版本、最新的更新 / 心跳时间、总数和查询参数生成），请求携带 If-None-Match
+    且数据未变化时返回 304，不执行列表查询。
+    
+    device_info 控制设备信息的返回方式：
+    - full：完整返回（默认）
+    - summary：只保留前几个标量字段，过长的值截断
+    - none：不返回设备信息，只返回 has_device_info，详情通过单个设备接口获取
+    """
+    conditions = _filter_conditions(filters)
+    total = await _count_filtered(db, filters, conditions)
+    etag = make_etag(await change_marker(db), total, request.url.query)
+    # no-cache：浏览器每次都带 If-None-Match 重新验证
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    sort_column = _SORT_COLUMNS[sort]
+    descending = order == "desc"
+    columns = [*_DEVICE_LIST_COLUMNS, _HAS_DEVICE_INFO if device_info == "none" else Device.device_info]
+    query = select(*columns).where(*conditions).order_by(
+        *((sort_column.desc(), Device.id.desc()) if descending else (sort_column.asc(), Device.id.asc()))
+    )
+    # 多取一行用于判断是否还有下一页
+    if not cursor:
+        query = query.limit(page_size + 1)
+        if cursor is None:
+            query = query.offset((page - 1) * page_size)
+        devices = [dict(row) for row in (await db.execute(query)).mappings()]
+    else:
+        devices = []
+        for part in _after_cursor(query, sort_column, descending, *decode_cursor(cursor, sort, order)):
+            result = await db.execute(part.limit(page_size + 1 - len(devices)))
+            devices += [dict(row) for row in result.mappings()]
+            if len(devices) > page_size:
+                break
+    next_cursor = None
+    if len(devices) > page_size:
+        devices.pop()
+        next_cursor = encode_cursor(sort, order, devices[-1][sort], devices[-1]["id"])
+    if device_info == "summary":
+        for row in devices:
+            row["device_info"] = _summarize_device_info(row["device_info"])
+    # 行数据直接序列化为 JSON 字节，跳过逐行的 Pydantic 校验
+    return Response(
+        content=to_json({"total": total, "devices": devices, "next_cursor": next_cursor}),
+        media_type="application/json",
+        headers=headers,
+    )
+
+@router.get("/devices/changes")
+async def get_device_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=_CHANGES_MAX_LIMIT),
+    device_info: Literal["full", "summary", "none"] = "none",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取版本号 since 之后新增、修改和删除的设备（需要登录）
+    
+    首次同步先加载设备列表，再以列表中最大的 change_version 作为 since；之后每次传入上次返回的 version。
+    has_more 为 true 时应立即继续获取；full_resync 为 true 时 since 已超出墓碑保留期，需要重新加载设备列表。
+    device_info 的含义与设备列表接口相同，默认不返回。
+    
+    始终读取主库：副本的复制延迟会让稳定窗口之前提交的变更暂时不可见，客户端会跳过这些版本。
+    """
+    columns = [*_DEVICE_LIST_COLUMNS, _HAS_DEVICE_INFO if device_info == "none" else Device.device_info]
+    changes = await read_changes(db, since, limit, columns)
+    if device_info == "summary":
+        for row in changes["devices"]:
+            row["device_info"] = _summarize_device_info(row["device_info"])
+    return Response(content=to_json(changes), media_type="application/json")
+
+@router.get("/devices/export")
+async def export_device_list(
+    request: Request,
+    format: ExportFormat = "ndjson",
+    filters: DeviceFilter = Depends(),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    导出设备（需要登录），支持与设备列表相同的过滤条件
+    
+    format=ndjson 每行一个 JSON 对象，format=csv 带表头、device_info 为 JSON 字符串。
+    按 id 分块查询并流式输出，导出整张表也只占用固定内存。
+    """
+    conditions = _filter_conditions(filters)
+    # 导出使用独立的会话分块查询，不占用请求的连接
+    await db.close()
+    filename = f"devices-{datetime.now():%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        export_devices(format, conditions, max(1, settings.bulk_chunk_size), read_session_factory(request)),
+        media_type="text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/devices/import")
+async def import_device_list(
+    request: Request,
+    format: ExportFormat = "ndjson",
+    mode: Literal["upsert", "insert"] = "upsert",
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    导入设备（需要登录），请求体格式与导出相同（NDJSON 或 CSV）
+    
+    mode=upsert 时已有设备按导入内容覆盖，mode=insert 时跳过已有设备。
+    请求体边接收边解析，按 BULK_CHUNK_SIZE 分批写入并逐批提交；无法解析的记录在 errors 中返回行号。
+    """
+    try:
+        result = await import_devices(
+            db, request.stream(), format, mode == "upsert", max(1, settings.bulk_chunk_size)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result.as_dict()
+
+@router.post("/devices/bulk")
+async def bulk_update_devices(
+    bulk: DeviceBulkRequest,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取所有设备列表（需要登录），按更新时间降序排列"""
-    total = db.query(Device).count()
-    devices = db.query(Device).order_by(Device.updated_at.desc()).offset((page - 1) * page_size).limit(page_size).all()
-    return {"total": total, "devices": [DeviceResponse.model_validate(d) for d in devices]}
+    """
+    批量授权（authorize）、撤销（revoke）或删除（delete）设备（需要登录）
+    
+    目标设备由 device_ids 或 filters（与设备列表的过滤条件相同，不能为空）指定，
+    按 BULK_CHUNK_SIZE 分块执行，每块单独提交。chunks 为每块实际修改或删除的设备数。
+    """
+    if (bulk.device_ids is None) == (bulk.filters is None):
+        raise HTTPException(status_code=400, detail="device_ids 和 filters 必须且只能提供一个")
+    device_ids = None
+    conditions = []
+    if bulk.filters is not None:
+        conditions = _filter_conditions(bulk.filters)
+        if not conditions:
+            raise HTTPException(status_code=400, detail="过滤条件不能为空")
+    else:
+        device_ids = list(dict.fromkeys(bulk.device_ids))
+    
+    chunk_size = max(1, settings.bulk_chunk_size)
+    if bulk.action == "delete":
+        chunks = await bulk_delete(db, device_ids, conditions, chunk_size)
+    else:
+        chunks = await bulk_set_authorized(db, bulk.action == "authorize", device_ids, conditions, chunk_size)
+    logger.info(f"批量操作 {bulk.action}: {sum(chunks)} 个设备，{len(chunks)} 块")
+    return {"action": bulk.action, "affected": sum(chunks), "chunks": chunks}
+
+@router.get("/events")
+async def get_device_events(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    设备事件流（Server-Sent Events，需要登录）
+    
+    事件类型：registered、authorized、revoked、updated、deleted（data 含 device_id），
+    touched（一个窗口内有心跳的设备，data 含 count、last_check，设备不多时含 device_ids），
+    resync（客户端积压过多事件已被丢弃，需要重新加载列表）。
+    批量操作的事件 data 含 device_ids 和 count，不含 device_id。
+    """
+    # 认证完成后立即释放数据库连接，长连接期间不占用连接池
+    await db.close()
+    queue = device_events.subscribe()
+    
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    batch = await asyncio.wait_for(queue.get(), _EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if batch is None:
+                    return
+                yield "".join(
+                    f"event: {event['type']}\ndata: {to_json(event).decode()}\n\n" for event in batch
+                )
+        finally:
+            device_events.unsubscribe(queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.get("/devices/{device_id}", response_model=DeviceResponse)
 async def get_device(
     device_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user)
 ):
     """获取单个设备信息（需要登录）"""
-    return get_device_or_404(device_id, db)
+    return await get_device_or_404(device_id, db)
 
 @router.put("/devices/{device_id}", response_model=DeviceResponse)
 async def update_device(
     device_id: str,
     device_update: DeviceUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """更新设备信息（需要登录）"""
@@ -52,50 +398,148 @@ async def update_device(
     
     if not update_data:
         # 没有要更新的数据，直接返回设备信息
-        return get_device_or_404(device_id, db)
+        return await get_device_or_404(device_id, db)
     
-    try:
-        # 使用 get_device_or_404 获取设备，减少重复代码
-        device = get_device_or_404(device_id, db)
-        
+    async def write(session: AsyncSession) -> Optional[Tuple[Device, bool]]:
+        result = await session.execute(select(Device).where(Device.device_id == device_id))
+        device = result.scalars().first()
+        if device is None:
+            return None
+        was_authorized = device.is_authorized
         # 更新对象属性（直接修改对象，避免批量更新的锁竞争）
         for key, value in update_data.items():
             setattr(device, key, value)
-        
+        if device.is_authorized != was_authorized:
+            await adjust_counters(session, device.software_name, authorized=1 if device.is_authorized else -1)
         # 无论更新什么字段，都更新 updated_at 时间戳
         device.updated_at = datetime.now()
-        
-        # 提交更改（使用 flush 然后 commit，减少锁持有时间）
-        db.flush()
-        db.commit()
-        db.refresh(device)  # 刷新对象以获取最新数据（包括数据库触发器的更新）
-        
-        return device
-    except HTTPException:
-        raise
+        await session.flush()
+        await session.refresh(device)  # 读取生成列等由数据库计算的值
+        return device, was_authorized
+    
+    try:
+        updated = await sqlite_writer.run(db, write)
     except OperationalError as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"数据库锁定，更新设备失败: {e}")
-        # 数据库锁定时，返回当前设备状态（不包含更新）
-        device = db.query(Device).filter(Device.device_id == device_id).first()
-        if device:
-            return device
-        raise HTTPException(status_code=500, detail="操作失败，请稍后重试")
+        # 更新没有生效，不能把旧数据当作更新结果返回
+        raise HTTPException(status_code=503, detail="数据库繁忙，更新未生效，请稍后重试", headers={"Retry-After": "1"})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"更新设备时发生错误: {e}")
         raise HTTPException(status_code=500, detail="更新失败，请稍后重试")
+    if updated is None:
+        raise HTTPException(status_code=404, detail="设备不存在")
+    device, was_authorized = updated
+    
+    # 授权状态可能已变化，立即写入决策缓存（共享表模式下所有 worker 同时生效）
+    if settings.decision_cache_enabled:
+        decision_cache.put(device.device_id, device.is_authorized, device.software_name, device.device_info)
+    if device.is_authorized != was_authorized:
+        device_events.publish("authorized" if device.is_authorized else "revoked", device.device_id)
+    else:
+        device_events.publish("updated", device.device_id)
+    return device
 
 @router.delete("/devices/{device_id}")
 async def delete_device(
     device_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """删除设备（需要登录）"""
-    deleted_count = db.query(Device).filter(Device.device_id == device_id).delete()
-    if deleted_count == 0:
+    async def write(session: AsyncSession) -> bool:
+        result = await session.execute(
+            select(Device.software_name, Device.is_authorized).where(Device.device_id == device_id)
+        )
+        row = result.first()
+        if row is None:
+            return False
+        result = await session.execute(delete(Device).where(Device.device_id == device_id))
+        if result.rowcount:
+            await adjust_counters(session, row.software_name, total=-1, authorized=-int(row.is_authorized))
+            await add_tombstones(session, [device_id])
+        return True
+    
+    if not await sqlite_writer.run(db, write):
         raise HTTPException(status_code=404, detail="设备不存在")
-    db.commit()
+    decision_cache.invalidate(device_id)
+    device_events.publish("deleted", device_id)
     return {"message": "已删除"}
 
+
+@router.get("/device-counts")
+async def get_device_counts(
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取设备总数、已授权数和按软件名的明细（读取增量维护的计数器，需要登录）"""
+    return await read_counters(db)
+
+
+@router.get("/stats")
+async def get_stats(
+    hours: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取设备统计（需要登录）：总数、已授权、已撤销，以及最近 hours 小时内有心跳的活跃设备数，按软件名汇总
+    
+    数据来自增量维护的计数器和定时刷新的活跃度快照（refreshed_at 为快照时间），
+    hours 只能取 STATS_ACTIVE_HOURS 中配置的窗口，默认 24。
+    """
+    windows = settings.stats_active_hours
+    if hours is None:
+        hours = 24 if 24 in windows or not windows else windows[0]
+    if hours not in windows:
+        raise HTTPException(status_code=400, detail=f"hours 只支持 {windows}")
+    return await read_stats(db, hours)
+
+
+@router.get("/activity")
+async def get_activity(
+    granularity: Literal["hour", "day"] = "hour",
+    days: int = Query(7, ge=1, le=366),
+    software_name: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取按软件名汇总的心跳历史（需要登录）：最近 days 天每小时 / 每天的心跳次数和活跃设备数
+    
+    需要开启 CHECK_HISTORY_ENABLED；桶由后台任务定时汇总，最近一段时间的数据会有 CHECK_HISTORY_ROLLUP_INTERVAL 的延迟。
+    """
+    since = datetime.now() - timedelta(days=days)
+    buckets = await read_software_activity(db, granularity, since, software_name)
+    return {"granularity": granularity, "buckets": buckets}
+
+
+@router.get("/devices/{device_id}/activity")
+async def get_device_activity(
+    device_id: str,
+    granularity: Literal["hour", "day"] = "hour",
+    days: int = Query(7, ge=1, le=366),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取单个设备最近 days 天每小时 / 每天的心跳次数（需要登录）"""
+    since = datetime.now() - timedelta(days=days)
+    buckets = await read_device_activity(db, device_id, granularity, since)
+    return {"device_id": device_id, "granularity": granularity, "buckets": buckets}
+
+
+@router.get("/runtime-stats")
+async def get_runtime_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """获取当前 worker 的运行时统计（缓存命中率、写回缓冲等，需要登录）"""
+    return {
+        "decision_cache": decision_cache.stats(),
+        "heartbeat_buffer": {"pending": len(heartbeat_buffer)},
+        "check_history": check_history.stats(),
+        "sqlite_writer": sqlite_writer.stats(),
+        "device_events": device_events.stats(),
+        "token_cache": token_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+    }
@@ -1,26 +1,112 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 import logging
-from app.database import get_db
-from app.models import Device
-from app.schemas import DeviceAuthRequest, EncryptedRequest, EncryptedResponse
+import time
+from app.database import get_db, settings
+from app.decision_cache import decision_cache
+from app.events import device_events
+from app.archive import restore_devices
+from app.heartbeat_buffer import heartbeat_buffer, touch_stmt
+from app.history import check_history
+from app.metrics import AUTHORIZATION_DECISIONS, count_decisions, count_devices, observe_stage, time_stage
+from app.sqlite_writer import sqlite_writer
+from app.upsert import device_row, device_upsert, upsert_device
+from app.counters import CounterDelta, adjust_counters
+from app.models import Device, device_info_digest
+from app.schemas import DeviceAuthRequest, DeviceBatchAuthRequest, DeviceDecision, EncryptedRequest, EncryptedResponse
 from app.auth import decrypt_request_data, encrypt_response_data
+from app import protocol
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["授权"])
 
+# 变化字段数不超过该值时按字段合并 device_info，否则整体替换
+_INFO_MERGE_MAX_FIELDS = 4
+# IN 查询每批的 device_id 数量（SQLite 绑定参数数量有限）
+_LOOKUP_CHUNK = 500
+
 
 def _decrypt_request_or_raise(encrypted_data: str) -> dict:
     """解密请求数据，失败则抛出异常"""
     data = decrypt_request_data(encrypted_data)
     if not data:
+        AUTHORIZATION_DECISIONS.labels("rejected").inc()
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="解密失败，无法验证设备")
     return data
 
 
-def _process_device(request: DeviceAuthRequest, db: Session) -> Device:
+def _is_touch_only(device, request: DeviceAuthRequest) -> bool:
+    """判断心跳是否只需要更新 last_check（软件名和设备信息均未变化）"""
+    if request.software_name is not None and request.software_name != device.software_name:
+        return False
+    if request.device_info is not None and device_info_digest(request.device_info) != device.device_info_digest:
+        return False
+    return True
+
+
+def _is_json_scalar(value: Any) -> bool:
+    # bool 在 SQLite 的 json_set 中会变成 0/1，不走字段合并
+    return value is None or (isinstance(value, (str, int, float)) and not isinstance(value, bool))
+
+
+def _device_info_value(old: Optional[Dict[str, Any]], new: Dict[str, Any]):
+    """
+    计算 device_info 的写入值
+
+    少量标量字段变化时生成 json_set/json_remove 表达式，只改动变化的字段；
+    否则返回新字典整体替换。SQLite 与 MySQL 均支持这两个 JSON 函数。
+    """
+    if not isinstance(old, dict):
+        return new
+    changed = {k: v for k, v in new.items() if k not in old or old[k] != v}
+    removed = [k for k in old if k not in new]
+    if len(changed) + len(removed) > min(_INFO_MERGE_MAX_FIELDS, len(new) // 2):
+        return new
+    if not all(_is_json_scalar(v) for v in changed.values()):
+        return new
+    if any('"' in k or '\\' in k for k in list(changed) + removed):
+        return new
+    value = Device.device_info
+    if removed:
+        value = func.json_remove(value, *[f'$."{k}"' for k in removed])
+    if changed:
+        args = []
+        for k, v in changed.items():
+            args.extend([f'$."{k}"', v])
+        value = func.json_set(value, *args)
+    return value
+
+
+async def _touch_device(device_id: str, db: AsyncSession) -> bool:
+    """
+    只更新设备最后检查时间
+
+    Returns:
+        设备是否仍然存在（写回模式下总是返回 True）
+    """
+    now = datetime.now()
+    if settings.heartbeat_write_behind:
+        heartbeat_buffer.touch(device_id, now)
+        return True
+    
+    async def write(session: AsyncSession) -> bool:
+        result = await session.execute(
+            update(Device).where(Device.device_id == device_id)
+            .values(last_check=now, change_version=Device.change_version)
+        )
+        return result.rowcount > 0
+    
+    with time_stage("device_touch"):
+        return await sqlite_writer.run(db, write)
+
+
+async def _process_device(request: DeviceAuthRequest, db: AsyncSession) -> bool:
     """
     统一处理设备逻辑：设备存在则更新信息，不存在则创建
     
@@ -29,48 +115,300 @@ def _process_device(request: DeviceAuthRequest, db: Session) -> Device:
         db: 数据库会话
         
     Returns:
-        处理后的设备对象
+        设备是否已授权
     """
-    device = db.query(Device).filter(Device.device_id == request.device_id).first()
-    
-    if device:
-        # 设备存在：更新设备信息
-        if request.software_name is not None:
-            device.software_name = request.software_name
-        if request.device_info is not None:
-            device.device_info = request.device_info
+    if settings.check_history_enabled:
+        check_history.record(request.device_id, request.software_name, datetime.now())
+    if settings.decision_cache_enabled:
+        cached = decision_cache.get(request.device_id)
+        if cached is not None and cached.matches(request.software_name, request.device_info):
+            # 缓存命中且内容未变化：不查询设备，只更新最后检查时间
+            if await _touch_device(request.device_id, db):
+                device_events.publish("touched", request.device_id)
+                count_devices("returning")
+                return cached.authorized
+            # 设备已被删除，按新设备处理
+            decision_cache.invalidate(request.device_id)
+    
+    now = datetime.now()
+    if settings.heartbeat_write_behind:
+        # 写回模式下先读取：只需更新 last_check 的心跳交给缓冲，不产生同步写入
+        with time_stage("device_query"):
+            result = await db.execute(
+                select(Device.is_authorized, Device.software_name, Device.device_info_digest)
+                .where(Device.device_id == request.device_id)
+            )
+            row = result.first()
+        if row is not None and _is_touch_only(row, request):
+            heartbeat_buffer.touch(request.device_id, now)
+            device_events.publish("touched", request.device_id)
+            count_devices("returning")
+            if settings.decision_cache_enabled:
+                decision_cache.put(request.device_id, row.is_authorized, row.software_name, request.device_info)
+            return row.is_authorized
+    
+    row = device_row(request.device_id, request.software_name, request.device_info, now)
+    query_seconds = 0.0
+    
+    async def write(session: AsyncSession) -> Tuple[bool, str, Optional[str]]:
+        nonlocal query_seconds
+        started = time.perf_counter()
+        # 注册或更新设备：一条原生 upsert 语句，同时返回授权状态
+        # （取不到原软件名，已有设备更换软件名时的计数偏差由定时对账修正）
+        authorized, created = await upsert_device(session, row)
+        kind = "new" if created else "returning"
+        software_name = request.software_name
+        if created:
+            # 归档过的设备再次心跳：恢复原来的授权状态
+            archived = (await restore_devices(session, [request.device_id])).get(request.device_id)
+            if archived is not None:
+                authorized = archived.is_authorized
+                software_name = software_name or archived.software_name
+                kind = "restored"
+            await adjust_counters(session, software_name, total=1, authorized=int(authorized))
+        query_seconds = time.perf_counter() - started
+        return authorized, kind, software_name
+    
+    started = time.perf_counter()
+    authorized, kind, software_name = await sqlite_writer.run(db, write)
+    # 提交耗时包括写入队列中的排队和合并提交
+    observe_stage("device_query", query_seconds)
+    observe_stage("device_commit", time.perf_counter() - started - query_seconds)
+    count_devices(kind)
+    if kind != "returning":
+        device_events.publish("registered", request.device_id, software_name=software_name)
     else:
-        # 设备不存在：创建新设备
-        device = Device(
-            device_id=request.device_id,
-            software_name=request.software_name,
-            device_info=request.device_info,
-            is_authorized=True  # 默认已授权
+        device_events.publish("touched", request.device_id)
+    
+    if settings.decision_cache_enabled:
+        decision_cache.put(request.device_id, authorized, software_name, request.device_info)
+    
+    return authorized
+
+
+async def _process_devices(requests: List[DeviceAuthRequest], db: AsyncSession) -> Dict[str, bool]:
+    """
+    批量处理设备心跳：集合查询已有设备，新设备批量插入，在一个事务中提交
+    
+    Args:
+        requests: 设备授权请求列表（同一 device_id 只保留最后一条）
+        db: 数据库会话
+        
+    Returns:
+        device_id -> 是否已授权
+    """
+    pending = {r.device_id: r for r in requests}
+    requests_by_id = dict(pending)
+    decisions: Dict[str, bool] = {}
+    touched: List[str] = []
+    now = datetime.now()
+    if settings.check_history_enabled:
+        for device_id, request in pending.items():
+            check_history.record(device_id, request.software_name, now)
+    
+    if settings.decision_cache_enabled:
+        for device_id, request in list(pending.items()):
+            cached = decision_cache.get(device_id)
+            if cached is not None and cached.matches(request.software_name, request.device_info):
+                decisions[device_id] = cached.authorized
+                touched.append(device_id)
+                del pending[device_id]
+    
+    existing = {}
+    ids = list(pending)
+    for i in range(0, len(ids), _LOOKUP_CHUNK):
+        result = await db.execute(
+            select(Device.id, Device.device_id, Device.software_name, Device.device_info_digest, Device.is_authorized)
+            .where(Device.device_id.in_(ids[i:i + _LOOKUP_CHUNK]))
+        )
+        existing.update((row.device_id, row) for row in result)
+    
+    # 设备信息有变化的设备才加载旧的 device_info，用于按字段合并
+    changed_info = [
+        row.id for device_id, row in existing.items()
+        if pending[device_id].device_info is not None
+        and device_info_digest(pending[device_id].device_info) != row.device_info_digest
+    ]
+    old_info = {}
+    for i in range(0, len(changed_info), _LOOKUP_CHUNK):
+        result = await db.execute(
+            select(Device.id, Device.device_info).where(Device.id.in_(changed_info[i:i + _LOOKUP_CHUNK]))
         )
-        db.add(device)
+        old_info.update((row.id, row.device_info) for row in result)
+    
+    new_rows = []
+    updates = []
+    counters = CounterDelta()
+    for device_id, request in pending.items():
+        row = existing.get(device_id)
+        if row is None:
+            new_rows.append(device_row(device_id, request.software_name, request.device_info, now))
+            counters.device_added(request.software_name, True)
+            decisions[device_id] = True
+            continue
+        decisions[device_id] = row.is_authorized
+        values = {}
+        if request.software_name is not None and request.software_name != row.software_name:
+            values["software_name"] = request.software_name
+            counters.device_removed(row.software_name, row.is_authorized)
+            counters.device_added(request.software_name, row.is_authorized)
+        if row.id in old_info:
+            values["device_info"] = _device_info_value(old_info[row.id], request.device_info)
+            values["device_info_digest"] = device_info_digest(request.device_info)
+        if values:
+            values["last_check"] = now
+            updates.append((row.id, values))
+        else:
+            touched.append(device_id)
     
-    # 更新最后检查时间（使用本地时间，与 created_at 和 updated_at 保持一致）
-    device.last_check = datetime.now()
-    db.commit()
-    db.refresh(device)
+    async def write(session: AsyncSession) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        for pk, values in updates:
+            await session.execute(
+                update(Device).where(Device.id == pk).values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        # 写入队列合并提交失败时会重新执行，计数变化和新设备列表每次从副本开始累积
+        delta = counters.copy()
+        created = list(new_rows)
+        if touched and not settings.heartbeat_write_behind:
+            result = await session.execute(touch_stmt, [{"b_device_id": d, "b_last_check": now} for d in touched])
+            if result.rowcount < len(touched):
+                # 缓存命中的设备可能已被删除（其他 worker 的缓存未失效）：与单个心跳一样按新设备注册
+                found = set()
+                for i in range(0, len(touched), _LOOKUP_CHUNK):
+                    found.update(await session.scalars(
+                        select(Device.device_id).where(Device.device_id.in_(touched[i:i + _LOOKUP_CHUNK]))
+                    ))
+                for device_id in touched:
+                    if device_id not in found:
+                        request = requests_by_id[device_id]
+                        created.append(device_row(device_id, request.software_name, request.device_info, now))
+                        delta.device_added(request.software_name, True)
+        restored = {}
+        if created:
+            # 查询之后可能已被并发请求注册，使用 upsert 避免唯一约束冲突
+            await session.execute(device_upsert(session.get_bind().dialect.name), created)
+            # 归档过的设备按归档中的授权状态和软件名计数
+            restored = await restore_devices(session, [row["device_id"] for row in created])
+            for row in created:
+                archived = restored.get(row["device_id"])
+                if archived is not None:
+                    delta.device_removed(row["software_name"], True)
+                    delta.device_added(row["software_name"] or archived.software_name, archived.is_authorized)
+        await delta.apply(session)
+        return created, restored
     
-    return device
+    created, restored = await sqlite_writer.run(db, write)
+    registered = {row["device_id"] for row in created}
+    for row in created[len(new_rows):]:
+        decision_cache.invalidate(row["device_id"])
+        decisions[row["device_id"]] = True
+        pending[row["device_id"]] = requests_by_id[row["device_id"]]
+    touched = [device_id for device_id in touched if device_id not in registered]
+    for device_id, archived in restored.items():
+        decisions[device_id] = archived.is_authorized
+    count_devices("new", len(created) - len(restored))
+    count_devices("restored", len(restored))
+    count_devices("returning", len(decisions) - len(created))
+    if touched and settings.heartbeat_write_behind:
+        for device_id in touched:
+            heartbeat_buffer.touch(device_id, now)
+    for row in created:
+        archived = restored.get(row["device_id"])
+        software_name = row["software_name"] or (archived.software_name if archived is not None else None)
+        device_events.publish("registered", row["device_id"], software_name=software_name)
+    # 已有设备（包括更新了软件名或设备信息的）都按 touched 推送
+    device_events.publish_touched({*touched, *(d for d in existing if d not in registered)})
+    
+    if settings.decision_cache_enabled:
+        for device_id, request in pending.items():
+            software_name = request.software_name
+            if software_name is None and device_id in existing:
+                software_name = existing[device_id].software_name
+            elif software_name is None and device_id in restored:
+                software_name = restored[device_id].software_name
+            decision_cache.put(device_id, decisions[device_id], software_name, request.device_info)
+    
+    return decisions
+
+
+def _encrypt_or_raise(data: dict) -> EncryptedResponse:
+    """加密响应数据，失败则抛出异常"""
+    encrypted = encrypt_response_data(data)
+    if not encrypted:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="加密响应失败")
+    return EncryptedResponse(encrypted_data=encrypted)
 
 
-@router.post("/heartbeat", response_model=EncryptedResponse)
-async def heartbeat(request: EncryptedRequest, db: Session = Depends(get_db)):
-    """设备心跳接口：检查授权状态、注册/更新设备（请求和响应都使用AES加密）"""
-    auth_request = DeviceAuthRequest(**_decrypt_request_or_raise(request.encrypted_data))
-    device = _process_device(auth_request, db)
+@router.post(
+    "/heartbeat",
+    response_model=EncryptedResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"$ref": "#/components/schemas/EncryptedRequest"}},
+                protocol.V2_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    },
+)
+async def heartbeat(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    设备心跳接口：检查授权状态、注册/更新设备
+    
+    按 Content-Type 协商协议版本：
+    - application/json：v1，Fernet 加密的 JSON 信封
+    - application/x-py-auth-v2：v2，AES-GCM 加密的二进制负载，响应同为二进制
+    """
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith(protocol.V2_CONTENT_TYPE):
+        data = protocol.decode_request(body)
+        if not data:
+            AUTHORIZATION_DECISIONS.labels("rejected").inc()
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="解密失败，无法验证设备")
+        authorized = await _process_device(DeviceAuthRequest(**data), db)
+        count_decisions([authorized])
+        encrypted = protocol.encode_response(authorized)
+        if not encrypted:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="加密响应失败")
+        return Response(content=encrypted, media_type=protocol.V2_CONTENT_TYPE)
+    
+    try:
+        encrypted_request = EncryptedRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    auth_request = DeviceAuthRequest(**_decrypt_request_or_raise(encrypted_request.encrypted_data))
+    authorized = await _process_device(auth_request, db)
+    count_decisions([authorized])
     
     response_data = {
-        "authorized": device.is_authorized,
-        "message": "设备已授权" if device.is_authorized else "设备未授权"
+        "authorized": authorized,
+        "message": "设备已授权" if authorized else "设备未授权"
     }
     
-    encrypted = encrypt_response_data(response_data)
-    if not encrypted:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="加密响应失败")
+    return _encrypt_or_raise(response_data)
+
+
+@router.post("/heartbeat/batch", response_model=EncryptedResponse)
+async def heartbeat_batch(request: EncryptedRequest, db: AsyncSession = Depends(get_db)):
+    """批量心跳接口：一个加密信封携带多个设备，返回加密的逐设备授权结果"""
+    batch = DeviceBatchAuthRequest(**_decrypt_request_or_raise(request.encrypted_data))
+    if len(batch.devices) > settings.heartbeat_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单次最多 {settings.heartbeat_batch_max_size} 个设备"
+        )
+    decisions = await _process_devices(batch.devices, db)
+    count_decisions(decisions[r.device_id] for r in batch.devices)
     
-    return EncryptedResponse(encrypted_data=encrypted)
+    results = [
+        DeviceDecision(
+            device_id=r.device_id,
+            authorized=decisions[r.device_id],
+            message="设备已授权" if decisions[r.device_id] else "设备未授权"
+        ).model_dump()
+        for r in batch.devices
+    ]
+    return _encrypt_or_raise({"results": results})
 
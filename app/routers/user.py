@@ -2,19 +2,18 @@
 用户认证路由
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import User
 from app.schemas import UserCreate, UserLogin, UserResponse, TokenResponse, ChangePasswordRequest
 from app.auth import (
     authenticate_user, 
-    create_access_token, 
     get_current_user,
-    verify_password,
-    get_password_hash,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    issue_access_token,
+    revoke_user_tokens,
 )
+from app.hashing import password_hasher
+from app.token_cache import CurrentUser
 
 router = APIRouter(prefix="/api/user", tags=["用户认证"])
 
@@ -22,10 +21,10 @@ router = APIRouter(prefix="/api/user", tags=["用户认证"])
 @router.post("/login", response_model=TokenResponse)
 async def login(
     user_data: UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """用户登录"""
-    user = authenticate_user(db, user_data.username, user_data.password)
+    user = await authenticate_user(db, user_data.username, user_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,10 +37,7 @@ async def login(
             detail="用户已被禁用"
         )
     
-    access_token = create_access_token(
-        data={"sub": user.username},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    access_token = issue_access_token(user)
     
     return TokenResponse(
         access_token=access_token,
@@ -53,7 +49,7 @@ async def login(
 
 @router.get("/me", response_model=UserResponse)
 async def get_me(
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """获取当前用户信息"""
     return current_user
@@ -61,7 +57,7 @@ async def get_me(
 
 @router.post("/verify")
 async def verify_token_endpoint(
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """验证令牌是否有效"""
     return {
@@ -74,12 +70,21 @@ async def verify_token_endpoint(
 @router.post("/change-password")
 async def change_password(
     password_data: ChangePasswordRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """更改密码"""
+    """更改密码，之前签发的令牌全部失效，响应中返回新的令牌"""
+    # current_user 是缓存的快照，修改需要重新加载
+    user = await db.get(User, current_user.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的认证凭据",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
     # 验证旧密码
-    if not verify_password(password_data.old_password, current_user.password_hash):
+    if not await password_hasher.verify(password_data.old_password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="旧密码错误"
@@ -92,12 +97,12 @@ async def change_password(
             detail="新密码不能与旧密码相同"
         )
     
-    # 更新密码
-    current_user.password_hash = get_password_hash(password_data.new_password)
-    db.commit()
-    db.refresh(current_user)
+    # 更新密码并递增凭据版本号
+    password_hash = await password_hasher.hash(password_data.new_password)
+    await revoke_user_tokens(db, user, password_hash=password_hash)
     
     return {
-        "message": "密码更改成功"
+        "message": "密码更改成功",
+        "access_token": issue_access_token(user)
     }
 
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
-from typing import Optional, Dict, Any
+import json
+from typing import Optional, Dict, Any, List, Literal
 
 class EncryptedRequest(BaseModel):
     """加密的请求数据"""
@@ -12,6 +13,10 @@ class DeviceAuthRequest(BaseModel):
     software_name: Optional[str] = None  # 软件名
     device_info: Optional[Dict[str, Any]] = None  # 设备信息（JSON格式，包含hostname等）
 
+class DeviceBatchAuthRequest(BaseModel):
+    """批量心跳请求（网关代为转发多个设备的心跳）"""
+    devices: List[DeviceAuthRequest]
+
 # 向后兼容：保留 DeviceCreate 作为别名
 DeviceCreate = DeviceAuthRequest
 
@@ -25,14 +30,57 @@ class DeviceResponse(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime]
     last_check: Optional[datetime]
+    hostname: Optional[str] = None  # 以下三项从设备信息中提取
+    ip_address: Optional[str] = None
+    mac_address: Optional[str] = None
+    change_version: Optional[int] = None  # 变更版本号（增量同步使用）
     
     class Config:
         from_attributes = True
 
+class DeviceFilter(BaseModel):
+    """设备过滤条件（设备列表的查询参数）"""
+    software_name: Optional[str] = None
+    is_authorized: Optional[bool] = None
+    last_check_from: Optional[datetime] = None  # 最后检查时间下限（含）
+    last_check_to: Optional[datetime] = None  # 最后检查时间上限（不含）
+    hostname: Optional[str] = None
+    ip_address: Optional[str] = None
+    mac_address: Optional[str] = None
+
 class DeviceUpdate(BaseModel):
     remark: Optional[str] = None
     is_authorized: Optional[bool] = None
 
+class DeviceImportRow(BaseModel):
+    """导入的单个设备（字段与导出一致，CSV 中的空字符串视为未设置）"""
+    device_id: str = Field(min_length=1, max_length=255)
+    software_name: Optional[str] = Field(None, max_length=255)
+    device_info: Optional[Dict[str, Any]] = None
+    remark: Optional[str] = None
+    is_authorized: bool = True
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    last_check: Optional[datetime] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def _empty_to_none(cls, data: Any) -> Any:
+        if isinstance(data, dict):
+            data = {k: (None if v == "" else v) for k, v in data.items()}
+            # CSV 中的设备信息是 JSON 字符串
+            if isinstance(data.get("device_info"), str):
+                data["device_info"] = json.loads(data["device_info"])
+            if data.get("is_authorized") is None:
+                data.pop("is_authorized", None)
+        return data
+
+class DeviceBulkRequest(BaseModel):
+    """批量操作请求：device_ids 和 filters 二选一"""
+    action: Literal["authorize", "revoke", "delete"]
+    device_ids: Optional[List[str]] = None
+    filters: Optional[DeviceFilter] = None
+
 # 向后兼容：保留 AuthCheckRequest 作为别名
 AuthCheckRequest = DeviceAuthRequest
 
@@ -40,6 +88,12 @@ class AuthCheckResponse(BaseModel):
     authorized: bool
     message: str
 
+class DeviceDecision(BaseModel):
+    """批量心跳中单个设备的授权结果"""
+    device_id: str
+    authorized: bool
+    message: str
+
 class EncryptedResponse(BaseModel):
     """加密的响应数据"""
     encrypted_data: str  # AES加密后的base64字符串
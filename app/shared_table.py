@@ -0,0 +1,208 @@
+"""
+跨 worker 共享的授权决策表
+
+基于内存映射文件（建议放在 /dev/shm）的定长槽位哈希表：
+device_id -> (授权状态, 版本号, 软件名/设备信息指纹, 过期时间)。
+
+- 读取不加锁：每个槽位带序列号（seqlock），写入期间序列号为奇数，
+  读取前后序列号不一致时重试
+- 写入通过 flock 在进程间串行化，写入频率远低于读取
+- 开放寻址 + 线性探测，探测长度有上限；探测范围内没有空位时淘汰最早过期的槽位
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from app.decision_cache import Decision, device_info_hash, text_hash
+
+_MAGIC = b"PYAUTHT1"
+# 头部：魔数、槽位数、全局版本号、淘汰计数、已用槽位数
+_HEADER = struct.Struct("<8sQQQQ")
+_HEADER_SIZE = 64
+# 槽位（64 字节，与缓存行对齐）：
+# 序列号、状态、授权、过期时间、版本号、软件名指纹、设备信息指纹、键
+_SLOT = struct.Struct("<IBBxxI4xQQQ16s8x")
+_SEQ = struct.Struct("<I")
+_EMPTY, _USED, _DELETED = 0, 1, 2
+_MAX_PROBE = 16
+_READ_RETRIES = 8
+
+
+def _slot_count(requested: int) -> int:
+    """槽位数取不小于请求值的 2 的幂"""
+    count = 1
+    while count < max(requested, _MAX_PROBE):
+        count <<= 1
+    return count
+
+
+class SharedDecisionTable:
+    """内存映射的共享授权决策表，接口与 DecisionCache 一致"""
+
+    shared = True
+
+    def __init__(self, path: str, slots: int, ttl: float):
+        self.path = path
+        self.slots = _slot_count(slots)
+        self.ttl = ttl
+        self._mask = self.slots - 1
+        # 线性探测在装载率超过一半后探测长度明显增加，预热时按一半槽位加载
+        self.max_size = self.slots // 2
+        size = _HEADER_SIZE + self.slots * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._write_lock():
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+            self._mm = mmap.mmap(self._fd, size)
+            magic, stored_slots = _HEADER.unpack_from(self._mm, 0)[:2]
+            if magic != _MAGIC or stored_slots != self.slots:
+                self._mm[:size] = bytes(size)
+                _HEADER.pack_into(self._mm, 0, _MAGIC, self.slots, 0, 0, 0)
+        # 命中统计只在当前进程内计数
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @contextmanager
+    def _write_lock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(device_id: str) -> bytes:
+        return hashlib.blake2b(device_id.encode("utf-8"), digest_size=16).digest()
+
+    def _offset(self, index: int) -> int:
+        return _HEADER_SIZE + (index & self._mask) * _SLOT.size
+
+    def _read_slot(self, offset: int):
+        """无锁读取一个槽位，写入进行中时重试"""
+        for _ in range(_READ_RETRIES):
+            slot = _SLOT.unpack_from(self._mm, offset)
+            if slot[0] & 1 == 0 and _SEQ.unpack_from(self._mm, offset)[0] == slot[0]:
+                return slot
+        return None
+
+    def _write_slot(self, offset: int, state: int, authorized: bool, expires_at: int,
+                    version: int, software_hash: int, info_hash: int, key: bytes):
+        # 调用方持有写锁：序列号先置为奇数，写完后再置为偶数
+        seq = _SEQ.unpack_from(self._mm, offset)[0]
+        _SEQ.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF)
+        _SLOT.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF, state, authorized, expires_at,
+                        version, software_hash, info_hash, key)
+        _SEQ.pack_into(self._mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _bump_header(self, evictions: int = 0, used: int = 0) -> int:
+        """递增全局版本号并更新计数（调用方持有写锁），返回新版本号"""
+        header = _HEADER.unpack_from(self._mm, 0)
+        version = header[2] + 1
+        _HEADER.pack_into(self._mm, 0, header[0], header[1], version, header[3] + evictions, header[4] + used)
+        return version
+
+    def _find(self, key: bytes) -> Optional[tuple]:
+        start = int.from_bytes(key[:8], "little")
+        for i in range(_MAX_PROBE):
+            slot = self._read_slot(self._offset(start + i))
+            if slot is None or slot[1] == _EMPTY:
+                return None
+            if slot[1] == _USED and slot[7] == key:
+                return slot
+        return None
+
+    def __len__(self) -> int:
+        return _HEADER.unpack_from(self._mm, 0)[4]
+
+    def get(self, device_id: str) -> Optional[Decision]:
+        slot = self._find(self._key(device_id))
+        if slot is None:
+            self.misses += 1
+            return None
+        if slot[3] <= time.time():
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Decision(bool(slot[2]), slot[5], slot[6], slot[3])
+
+    def put(self, device_id: str, authorized: bool, software_name: Optional[str],
+            device_info: Optional[Dict[str, Any]]):
+        key = self._key(device_id)
+        start = int.from_bytes(key[:8], "little")
+        now = time.time()
+        expires_at = int(now + self.ttl)
+        with self._write_lock():
+            target = None
+            target_used = False
+            oldest = None
+            for i in range(_MAX_PROBE):
+                offset = self._offset(start + i)
+                slot = _SLOT.unpack_from(self._mm, offset)
+                if slot[1] == _USED and slot[7] == key:
+                    target, target_used = offset, True
+                    break
+                if target is None and (slot[1] != _USED or slot[3] <= now):
+                    # 空位、墓碑或已过期的条目都可以复用
+                    target, target_used = offset, slot[1] == _USED
+                if slot[1] == _EMPTY:
+                    break
+                if slot[1] == _USED and (oldest is None or slot[3] < oldest[1]):
+                    oldest = (offset, slot[3])
+            evictions = 0
+            if target is None:
+                # 探测范围已满，淘汰最早过期的条目
+                target, target_used = oldest[0], True
+                evictions = 1
+            version = self._bump_header(evictions=evictions, used=0 if target_used else 1)
+            self._write_slot(target, _USED, authorized, expires_at, version,
+                             text_hash(software_name), device_info_hash(device_info), key)
+
+    def invalidate(self, device_id: str):
+        key = self._key(device_id)
+        start = int.from_bytes(key[:8], "little")
+        with self._write_lock():
+            for i in range(_MAX_PROBE):
+                offset = self._offset(start + i)
+                slot = _SLOT.unpack_from(self._mm, offset)
+                if slot[1] == _EMPTY:
+                    return
+                if slot[1] == _USED and slot[7] == key:
+                    # 保留墓碑，保证后续探测链不断开
+                    self._write_slot(offset, _DELETED, False, 0, self._bump_header(used=-1), 0, 0, key)
+                    self.invalidations += 1
+                    return
+
+    def clear(self):
+        size = self.slots * _SLOT.size
+        with self._write_lock():
+            self._mm[_HEADER_SIZE:_HEADER_SIZE + size] = bytes(size)
+            header = _HEADER.unpack_from(self._mm, 0)
+            _HEADER.pack_into(self._mm, 0, header[0], header[1], header[2] + 1, header[3], 0)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        _, _, version, evictions, used = _HEADER.unpack_from(self._mm, 0)
+        return {
+            "shared": True,
+            "path": self.path,
+            "size": used,
+            "max_size": self.max_size,
+            "slots": self.slots,
+            "ttl": self.ttl,
+            "version": version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
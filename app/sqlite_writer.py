@@ -0,0 +1,171 @@
+"""
+SQLite 串行写入队列
+
+SQLite 同一时间只允许一个写事务，多个 worker 同时写入时会互相等待锁，超过 busy_timeout 就报
+"database is locked"。开启 SQLITE_PRODUCTION 后，所有运行期的写入（心跳、写回缓冲、管理端修改、
+批量操作和导入的每块、归档 / 汇总 / 对账等后台任务、登录时的重新哈希和修改密码）不再各自提交，
+而是交给本 worker 的写入任务排队执行：
+- 队列中已积压的事务合并为一个事务提交（group commit），一次 fsync 完成多个请求的写入
+- 写入前先获取数据库文件旁的文件锁，各 worker 的写入任务依次执行，不再争抢 SQLite 的写锁
+- 合并的事务中有一个失败时整体回滚，再逐个单独执行，失败只影响对应的请求
+
+未开启时 run() 直接在调用方的会话中执行并提交，行为与原来一致。
+"""
+import asyncio
+import logging
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, async_engine, settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+WriteJob = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class SQLiteWriter:
+    """
+    串行写入队列（每个 worker 一个写入任务，跨 worker 通过文件锁串行）
+
+    写入函数接收会话、只执行语句不提交，返回值在提交成功后交给调用方。
+    合并提交失败时写入函数可能被再次执行，因此不能在其中产生数据库之外的副作用
+    （发布事件、更新缓存等应在 run() 返回之后进行）。
+    """
+
+    def __init__(self, lock_path: str, batch_size: int):
+        self.lock_path = lock_path
+        self.batch_size = max(1, batch_size)
+        self.enabled = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock_file = None
+        self.batches = 0
+        self.jobs = 0
+        self.max_batch = 0
+        self.fallbacks = 0
+
+    async def run(self, db: AsyncSession, job: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        """执行写入函数并提交；开启队列时在写入任务的会话中执行，否则在 db 中执行"""
+        if not self.enabled:
+            result = await job(db)
+            await db.commit()
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((job, future))
+        return await future
+
+    def start(self):
+        """启动写入任务（需在事件循环内调用）"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(), name="sqlite-writer")
+            self.enabled = True
+
+    async def stop(self):
+        """执行完已排队的写入后停止，之后的写入直接在调用方会话中提交"""
+        if self._task is None:
+            return
+        self.enabled = False
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        self._queue = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # 获取文件锁失败等：通知本批所有调用方
+                logger.error(f"SQLite 写入队列执行失败: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _write(self, batch: List[Tuple[WriteJob, asyncio.Future]]):
+        async with self._exclusive():
+            if len(batch) == 1:
+                await self._write_one(*batch[0])
+                return
+            try:
+                async with AsyncSessionLocal() as db:
+                    results = [await job(db) for job, _ in batch]
+                    await db.commit()
+            except Exception:
+                # 合并的事务中有写入失败：逐个单独执行，互不影响
+                self.fallbacks += 1
+                for job, future in batch:
+                    await self._write_one(job, future)
+                return
+        self._record(len(batch))
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _write_one(self, job: WriteJob, future: asyncio.Future):
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await job(db)
+                await db.commit()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        self._record(1)
+        if not future.done():
+            future.set_result(result)
+
+    def _record(self, size: int):
+        self.batches += 1
+        self.jobs += size
+        self.max_batch = max(self.max_batch, size)
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """跨 worker 的写入文件锁（Windows 下只在本进程内串行）"""
+        if sys.platform == "win32":
+            yield
+            return
+        import fcntl
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, "a")
+        await asyncio.to_thread(fcntl.flock, self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "avg_batch": round(self.jobs / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "fallbacks": self.fallbacks,
+        }
+
+
+sqlite_writer = SQLiteWriter(
+    lock_path=f"{async_engine.url.database}.write.lock",
+    batch_size=settings.sqlite_writer_batch_size,
+)
@@ -0,0 +1,98 @@
+"""
+设备统计快照
+
+按软件名的已授权 / 已撤销数来自增量维护的设备计数器（app/counters.py）；
+最近 N 小时活跃设备数由后台任务定时统计后写入 software_activity 表，
+统计接口只读取这两张小表，不在每次请求时对 devices 表做 GROUP BY。
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.counters import read_counters
+from app.database import AsyncSessionLocal, settings
+from app.models import Device, SoftwareActivity
+from app.sqlite_writer import sqlite_writer
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+async def refresh_activity(db: AsyncSession, windows: List[int]) -> int:
+    """统计各窗口内的活跃设备数并替换快照，返回快照行数"""
+    if not windows:
+        return 0
+    now = datetime.now()
+    since = {hours: now - timedelta(hours=hours) for hours in windows}
+    # 按 last_check 索引（ix_devices_last_check）定位最大窗口内的设备，一次扫描算出所有窗口
+    result = await db.execute(
+        select(
+            Device.software_name,
+            *[func.sum(case((Device.last_check >= since[hours], 1), else_=0)) for hours in windows],
+        )
+        .where(Device.last_check >= min(since.values()))
+        .group_by(Device.software_name)
+    )
+    active: Dict[tuple, int] = {}
+    for row in result:
+        for hours, count in zip(windows, row[1:]):
+            # NULL 与空字符串合并，与设备计数器一致
+            key = (row[0] or "", hours)
+            active[key] = active.get(key, 0) + int(count or 0)
+    rows = [
+        {"software_name": name, "hours": hours, "active": count, "refreshed_at": now}
+        for (name, hours), count in active.items()
+    ]
+    
+    # 统计查询在写事务之外执行，只有替换快照经 SQLite 写入队列
+    async def write(session: AsyncSession):
+        await session.execute(delete(SoftwareActivity))
+        if rows:
+            await session.execute(SoftwareActivity.__table__.insert(), rows)
+    
+    await sqlite_writer.run(db, write)
+    return len(rows)
+
+
+async def read_stats(db: AsyncSession, hours: int) -> Dict[str, Any]:
+    """读取统计：按软件名的设备总数、已授权、已撤销以及最近 hours 小时活跃数"""
+    counters = await read_counters(db)
+    result = await db.execute(
+        select(SoftwareActivity.software_name, SoftwareActivity.active, SoftwareActivity.refreshed_at)
+        .where(SoftwareActivity.hours == hours)
+    )
+    active: Dict[str, int] = {}
+    refreshed_at: Optional[datetime] = None
+    for row in result:
+        active[row.software_name] = row.active
+        refreshed_at = row.refreshed_at
+    by_software = [
+        {
+            "software_name": item["software_name"],
+            "total": item["total"],
+            "authorized": item["authorized"],
+            "revoked": item["unauthorized"],
+            "active": active.get(item["software_name"] or "", 0),
+        }
+        for item in counters["by_software"]
+    ]
+    return {
+        "hours": hours,
+        "refreshed_at": refreshed_at,
+        "total": counters["total"],
+        "authorized": counters["authorized"],
+        "revoked": counters["unauthorized"],
+        "active": sum(active.values()),
+        "by_software": by_software,
+    }
+
+
+async def _refresh():
+    async with AsyncSessionLocal() as db:
+        await refresh_activity(db, settings.stats_active_hours)
+
+
+stats_refresher = PeriodicTask("fleet-stats-refresh", settings.stats_refresh_interval, _refresh)
@@ -0,0 +1,67 @@
+"""
+后台周期任务
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    按固定间隔在事件循环中执行的后台任务
+
+    可以通过 wake() 提前唤醒执行一次（例如缓冲区达到阈值时）。
+    stop() 会等待当前执行结束，然后再执行一次收尾调用。
+    """
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[object]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def start(self):
+        """启动任务（需在事件循环内调用）"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    def wake(self):
+        """提前唤醒任务"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self, final_run: bool = True):
+        """停止任务，默认在停止后再执行一次（用于关闭时刷新缓冲）"""
+        if self._task is None:
+            return
+        # 不直接取消任务，避免打断正在进行的写入
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self._wakeup = None
+        if final_run:
+            await self._run_once()
+
+    async def _run_once(self):
+        try:
+            await self.func()
+        except Exception as e:
+            logger.error(f"后台任务 {self.name} 执行失败: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            self._wakeup.clear()
+            await self._run_once()
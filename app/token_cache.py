@@ -0,0 +1,131 @@
+"""
+登录令牌缓存
+
+按令牌缓存已验证的用户快照，命中时跳过 JWT 签名校验和用户查询。
+条目过期时间不晚于令牌本身的 exp，也不超过 TOKEN_CACHE_TTL（限制其他 worker 上的过期数据存活时间）。
+
+用户修改密码或被禁用时递增凭据版本号（users.credential_version），
+本 worker 立即清除该用户的缓存；签发时的版本号写入令牌（cv），与数据库不一致的令牌不再有效。
+同一台机器上的其他 worker 通过共享的代数文件（TOKEN_CACHE_GENERATION_PATH）得知有令牌失效：
+失效时向文件追加一个字节，每次读取缓存前检查文件的大小和修改时间，变化时清空本 worker 的缓存。
+多台机器部署时，其他机器上的缓存最多在 TOKEN_CACHE_TTL 秒内仍接受旧令牌。
+"""
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from app.database import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CurrentUser(NamedTuple):
+    """缓存的用户快照（只读，字段与 UserResponse 一致）"""
+    id: int
+    username: str
+    is_active: bool
+    is_admin: bool
+    created_at: Optional[datetime]
+    credential_version: int
+    expires_at: float
+
+    @classmethod
+    def from_user(cls, user, expires_at: float) -> "CurrentUser":
+        return cls(
+            user.id, user.username, user.is_active, user.is_admin, user.created_at,
+            user.credential_version or 0, expires_at,
+        )
+
+
+class TokenCache:
+    """有界 LRU 令牌缓存（每个 worker 一份，仅在事件循环线程中访问）"""
+
+    def __init__(self, max_size: int, ttl: float, generation_path: str):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.generation_path = generation_path
+        self._entries: "OrderedDict[str, CurrentUser]" = OrderedDict()
+        self._generation = self._read_generation()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        generation = self._read_generation()
+        if generation != self._generation:
+            # 其他 worker 使令牌失效：不区分用户，整体清空
+            self._generation = generation
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry
+
+    def put(self, token: str, user, token_exp: Optional[float]) -> CurrentUser:
+        """缓存用户快照并返回（token_exp 为令牌的 exp，Unix 时间戳）"""
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        entry = CurrentUser.from_user(user, expires_at)
+        self._entries[token] = entry
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate_user(self, username: str):
+        """清除该用户的所有令牌，并通知其他 worker 清空缓存"""
+        stale = [token for token, entry in self._entries.items() if entry.username == username]
+        for token in stale:
+            del self._entries[token]
+        self.invalidations += len(stale)
+        try:
+            with open(self.generation_path, "ab") as f:
+                f.write(b".")
+        except OSError as e:
+            logger.error(f"更新令牌失效标记失败，其他 worker 最多在 {self.ttl} 秒内仍接受旧令牌: {e}")
+
+    def _read_generation(self) -> tuple:
+        try:
+            stat = os.stat(self.generation_path)
+        except OSError:
+            return (0, 0)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+token_cache = TokenCache(
+    max_size=settings.token_cache_size,
+    ttl=settings.token_cache_ttl,
+    generation_path=settings.token_cache_generation_path
+    or os.path.join(tempfile.gettempdir(), "py_auth_token_generation"),
+)
@@ -0,0 +1,262 @@
+"""
+设备导出 / 导入
+
+导出按 id 分块查询，每块是一个独立的短查询（不长时间占用读事务，也不阻塞 SQLite 写入），
+逐块编码为 NDJSON 或 CSV 后流式输出，内存占用与表的大小无关。
+导入边接收请求体边解析，按批 upsert 并逐批提交（经 SQLite 写入队列），计数器、决策缓存和设备事件随之更新。
+"""
+import codecs
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from pydantic_core import to_json
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.counters import CounterDelta
+from app.database import AsyncSessionLocal
+from app.decision_cache import decision_cache
+from app.events import device_events
+from app.models import ArchivedDevice, Device, device_info_digest
+from app.schemas import DeviceImportRow
+from app.sqlite_writer import sqlite_writer
+from app.upsert import import_upsert
+
+logger = logging.getLogger(__name__)
+
+ExportFormat = Literal["ndjson", "csv"]
+
+# 导出 / 导入的字段
+EXPORT_COLUMNS = (
+    Device.device_id,
+    Device.software_name,
+    Device.device_info,
+    Device.remark,
+    Device.is_authorized,
+    Device.created_at,
+    Device.updated_at,
+    Device.last_check,
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+# 导入结果中最多返回的错误条数
+_MAX_IMPORT_ERRORS = 100
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return value
+
+
+def _encode(rows: List[Any], fmt: ExportFormat) -> bytes:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([_csv_value(row[field]) for field in EXPORT_FIELDS] for row in rows)
+        return buffer.getvalue().encode("utf-8")
+    return b"".join(to_json({field: row[field] for field in EXPORT_FIELDS}) + b"\n" for row in rows)
+
+
+async def export_devices(fmt: ExportFormat, conditions: List[Any], chunk_size: int,
+                         session_factory: async_sessionmaker = AsyncSessionLocal) -> AsyncIterator[bytes]:
+    """按 id 分块导出设备（session_factory 可指定只读副本）"""
+    if fmt == "csv":
+        yield (",".join(EXPORT_FIELDS) + "\r\n").encode("utf-8")
+    async with session_factory() as db:
+        last_id = 0
+        while True:
+            result = await db.execute(
+                select(Device.id, *EXPORT_COLUMNS)
+                .where(Device.id > last_id, *conditions)
+                .order_by(Device.id)
+                .limit(chunk_size)
+            )
+            rows = result.mappings().all()
+            # 每块结束后释放连接，等待客户端接收期间不占用事务
+            await db.commit()
+            if not rows:
+                return
+            yield _encode(rows, fmt)
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]["id"]
+
+
+async def _records(body: AsyncIterator[bytes], fmt: ExportFormat) -> AsyncIterator[tuple]:
+    """逐条读取请求体中的记录，返回 (行号, 原始文本)；CSV 中带引号的字段可以跨行"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    line_no = 0
+    record = ""
+    record_line = 0
+    async for chunk in body:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_no += 1
+            if fmt == "ndjson":
+                yield line_no, line
+                continue
+            if not record:
+                record_line = line_no
+            record += line + "\n"
+            # 引号成对时记录结束
+            if record.count('"') % 2 == 0:
+                yield record_line, record
+                record = ""
+    pending += decoder.decode(b"", final=True)
+    if pending or record:
+        yield (line_no + 1 if not record else record_line), record + pending
+
+
+def _parse(text: str, fmt: ExportFormat, header: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    if fmt == "ndjson":
+        text = text.strip()
+        if not text:
+            return None
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("每行必须是 JSON 对象")
+        return data
+    values = next(csv.reader([text]), None)
+    if not values or values == [""]:
+        return None
+    if len(values) != len(header):
+        raise ValueError(f"字段数 {len(values)} 与表头 {len(header)} 不一致")
+    return dict(zip(header, values))
+
+
+class ImportResult:
+    """导入统计"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < _MAX_IMPORT_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+async def _write_batch(db: AsyncSession, batch: Dict[str, Dict[str, Any]], overwrite: bool, result: ImportResult):
+    async def write(session: AsyncSession) -> Tuple[Set[str], Set[str]]:
+        device_ids = list(batch)
+        result_rows = await session.execute(
+            select(Device.device_id, Device.software_name, Device.is_authorized)
+            .where(Device.device_id.in_(device_ids))
+        )
+        existing = {row.device_id: row for row in result_rows}
+        # 已归档的设备：覆盖时以导入内容为准并删除归档记录（否则之后的恢复会用归档中的授权状态和备注覆盖导入的值），
+        # 不覆盖时与已有设备一样跳过
+        archived = set(await session.scalars(
+            select(ArchivedDevice.device_id).where(ArchivedDevice.device_id.in_(device_ids))
+        )) - set(existing)
+        if overwrite and archived:
+            await session.execute(delete(ArchivedDevice).where(ArchivedDevice.device_id.in_(list(archived))))
+        rows = [row for device_id, row in batch.items() if overwrite or device_id not in archived]
+        counters = CounterDelta()
+        for row in rows:
+            old = existing.get(row["device_id"])
+            if old is None:
+                counters.device_added(row["software_name"], row["is_authorized"])
+            elif overwrite:
+                counters.device_removed(old.software_name, old.is_authorized)
+                counters.device_added(row["software_name"], row["is_authorized"])
+        if rows:
+            await session.execute(import_upsert(session.get_bind().dialect.name, overwrite), rows)
+        await counters.apply(session)
+        return set(existing), set() if overwrite else archived
+    
+    existing, skipped_archived = await sqlite_writer.run(db, write)
+    result.skipped += len(skipped_archived)
+
+    inserted = [device_id for device_id in batch if device_id not in existing and device_id not in skipped_archived]
+    result.inserted += len(inserted)
+    result.batches += 1
+    device_events.publish_many("registered", inserted)
+    if overwrite:
+        updated = list(existing)
+        result.updated += len(updated)
+        for device_id in updated:
+            decision_cache.invalidate(device_id)
+        device_events.publish_many("updated", updated)
+    else:
+        result.skipped += len(existing)
+
+
+async def import_devices(db: AsyncSession, body: AsyncIterator[bytes], fmt: ExportFormat,
+                         overwrite: bool, batch_size: int) -> ImportResult:
+    """
+    流式导入设备
+
+    overwrite 为 True 时已有设备按导入内容覆盖（created_at 保留），已归档的设备删除归档记录后按导入内容插入；
+    否则跳过已有设备和已归档的设备。
+    无法解析的记录计入 failed，不影响其他记录；CSV 表头缺少 device_id 时抛出 ValueError。
+    """
+    result = ImportResult()
+    header: Optional[List[str]] = None
+    # 同一批内重复的 device_id 只保留最后一条
+    batch: Dict[str, Dict[str, Any]] = {}
+    now = datetime.now()
+    async for line_no, text in _records(body, fmt):
+        if fmt == "csv" and header is None:
+            header = [name.strip() for name in next(csv.reader([text]), [])]
+            if "device_id" not in header:
+                raise ValueError("CSV 表头缺少 device_id")
+            continue
+        try:
+            data = _parse(text, fmt, header)
+            if data is None:
+                continue
+            item = DeviceImportRow.model_validate(data)
+        except ValidationError as e:
+            error = e.errors()[0]
+            result.error(line_no, f"{'.'.join(str(part) for part in error['loc']) or '记录'}: {error['msg']}")
+            continue
+        except ValueError as e:
+            result.error(line_no, str(e))
+            continue
+        batch[item.device_id] = {
+            "device_id": item.device_id,
+            "software_name": item.software_name,
+            "device_info": item.device_info,
+            "device_info_digest": device_info_digest(item.device_info),
+            "remark": item.remark,
+            "is_authorized": item.is_authorized,
+            "created_at": item.created_at or now,
+            "updated_at": item.updated_at or now,
+            "last_check": item.last_check,
+        }
+        if len(batch) >= batch_size:
+            await _write_batch(db, batch, overwrite, result)
+            batch = {}
+    if batch:
+        await _write_batch(db, batch, overwrite, result)
+    logger.info(f"设备导入完成: {result.as_dict()}")
+    return result
@@ -0,0 +1,137 @@
+"""
+设备注册/心跳的原生 upsert 语句
+
+SQLite 使用 INSERT ... ON CONFLICT DO UPDATE ... RETURNING，
+MySQL 使用 INSERT ... ON DUPLICATE KEY UPDATE。同一设备并发首次心跳时不会触发唯一约束错误，
+并且一条语句即可拿到授权状态，不需要再 SELECT 或 refresh。
+"""
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import and_, case, func, literal_column, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Device, device_info_digest
+
+# MySQL 的 ON DUPLICATE KEY UPDATE 不支持 RETURNING：更新时通过 LAST_INSERT_ID(expr)
+# 把授权状态加上该偏移量带回 lastrowid，插入时 lastrowid 为新行自增 id（远小于偏移量）
+_MYSQL_AUTH_TAG = 1 << 40
+
+
+def _state_changed(new):
+    """心跳是否改变了设备状态（携带了不同的软件名或设备信息），只刷新 last_check 时不生成新的变更版本号"""
+    return or_(
+        and_(new.software_name.is_not(None), Device.software_name.is_distinct_from(new.software_name)),
+        and_(new.device_info_digest.is_not(None), Device.device_info_digest.is_distinct_from(new.device_info_digest)),
+    )
+
+
+def _sqlite_upsert():
+    stmt = sqlite_insert(Device)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[Device.device_id],
+        set_={
+            "software_name": func.coalesce(excluded.software_name, Device.software_name),
+            # 摘要一致或未携带设备信息时保留原值
+            "device_info": case(
+                (or_(excluded.device_info_digest.is_(None),
+                     excluded.device_info_digest == Device.device_info_digest), Device.device_info),
+                else_=excluded.device_info,
+            ),
+            "device_info_digest": func.coalesce(excluded.device_info_digest, Device.device_info_digest),
+            "last_check": excluded.last_check,
+            # ON CONFLICT 不会触发列的 onupdate，需要显式更新
+            "updated_at": excluded.updated_at,
+            "change_version": case((_state_changed(excluded), excluded.change_version), else_=Device.change_version),
+        },
+    )
+
+
+def _mysql_upsert():
+    stmt = mysql_insert(Device)
+    inserted = stmt.inserted
+    # MySQL 按顺序执行赋值，后面的表达式会看到前面已更新的值：变更版本号需在软件名和摘要之前计算，
+    # device_info 必须在摘要之前更新
+    return stmt.on_duplicate_key_update([
+        ("change_version", case((_state_changed(inserted), inserted.change_version), else_=Device.change_version)),
+        ("software_name", func.coalesce(inserted.software_name, Device.software_name)),
+        ("device_info", case(
+            (or_(inserted.device_info_digest.is_(None),
+                 inserted.device_info_digest == Device.device_info_digest), Device.device_info),
+            else_=inserted.device_info,
+        )),
+        ("device_info_digest", func.coalesce(inserted.device_info_digest, Device.device_info_digest)),
+        ("last_check", inserted.last_check),
+        ("updated_at", inserted.updated_at),
+        ("is_authorized", literal_column(f"LAST_INSERT_ID(is_authorized + {_MYSQL_AUTH_TAG}) - {_MYSQL_AUTH_TAG}")),
+    ])
+
+
+# 导入覆盖已有设备时更新的列（created_at 保留原值）
+_IMPORT_COLUMNS = (
+    "software_name", "device_info", "device_info_digest", "remark", "is_authorized",
+    "updated_at", "last_check", "change_version",
+)
+
+
+@lru_cache(maxsize=None)
+def import_upsert(dialect_name: str, overwrite: bool):
+    """设备导入语句：overwrite 时已有设备按导入内容覆盖，否则保持不变"""
+    if dialect_name == "mysql":
+        stmt = mysql_insert(Device)
+        if overwrite:
+            return stmt.on_duplicate_key_update([(name, stmt.inserted[name]) for name in _IMPORT_COLUMNS])
+        return stmt.on_duplicate_key_update(device_id=Device.device_id)
+    stmt = sqlite_insert(Device)
+    if overwrite:
+        return stmt.on_conflict_do_update(
+            index_elements=[Device.device_id],
+            set_={name: stmt.excluded[name] for name in _IMPORT_COLUMNS},
+        )
+    return stmt.on_conflict_do_nothing(index_elements=[Device.device_id])
+
+
+@lru_cache(maxsize=None)
+def device_upsert(dialect_name: str):
+    """构造设备 upsert 语句（参数在执行时传入，可用于单行或批量）"""
+    if dialect_name == "mysql":
+        return _mysql_upsert()
+    return _sqlite_upsert()
+
+
+def device_row(device_id: str, software_name: Optional[str], device_info: Optional[Dict[str, Any]],
+               now: datetime) -> Dict[str, Any]:
+    """构造 upsert 参数（新设备默认已授权）"""
+    return {
+        "device_id": device_id,
+        "software_name": software_name,
+        "device_info": device_info,
+        "device_info_digest": device_info_digest(device_info),
+        "is_authorized": True,
+        "created_at": now,
+        "updated_at": now,
+        "last_check": now,
+    }
+
+
+async def upsert_device(db: AsyncSession, row: Dict[str, Any]) -> Tuple[bool, bool]:
+    """
+    注册或更新一个设备
+
+    Returns:
+        (是否已授权, 是否为新创建的设备)
+    """
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "mysql":
+        result = await db.execute(device_upsert(dialect_name).values(**row))
+        if result.lastrowid >= _MYSQL_AUTH_TAG:
+            return bool(result.lastrowid - _MYSQL_AUTH_TAG), False
+        return True, True
+    stmt = device_upsert(dialect_name).values(**row).returning(Device.is_authorized, Device.created_at)
+    authorized, created_at = (await db.execute(stmt)).one()
+    # 冲突更新不会修改 created_at，与本次写入时间相同说明是新插入的行
+    return bool(authorized), created_at == row["created_at"]
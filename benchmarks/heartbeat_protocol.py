@@ -0,0 +1,128 @@
+"""
+心跳协议 v1 / v2 对比基准
+
+对比每次心跳的传输字节数（请求体、响应体）以及编解码 CPU 耗时：
+- 客户端：编码请求 + 解码响应
+- 服务端：解码请求 + 编码响应
+
+只测量协议编解码本身，不包含网络和数据库开销。
+
+用法（在仓库根目录执行，需要安装服务端和 client/python 的依赖）：
+
+    CLIENT_SECRET=xxx python benchmarks/heartbeat_protocol.py [-n 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "client", "python"))
+os.environ.setdefault("CLIENT_SECRET", "benchmark-secret")
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: E402
+
+from app import protocol  # noqa: E402
+from app.auth import CLIENT_SECRET, decrypt_request_data, encrypt_response_data  # noqa: E402
+from py_auth_client.auth_client import (  # noqa: E402
+    AuthClient,
+    decode_response_v2,
+    derive_v2_key,
+    encode_request_v2,
+)
+
+DEVICE_ID = "3f6c1a2b9d8e4f7a0b1c2d3e4f5a6b7c"
+SOFTWARE_NAME = "demo-software"
+DEVICE_INFO = {
+    "hostname": "workstation-01",
+    "platform": "Linux-6.8.0-x86_64-with-glibc2.39",
+    "system": "Linux",
+    "release": "6.8.0",
+    "machine": "x86_64",
+    "processor": "x86_64",
+    "ip_address": "192.168.1.23",
+    "mac_address": "00:1a:2b:3c:4d:5e",
+    "cpu_count": 16,
+    "memory_total": 34359738368,
+}
+
+
+def _make_client():
+    """只初始化加解密部分，不采集本机设备信息"""
+    client = AuthClient.__new__(AuthClient)
+    client.client_secret = CLIENT_SECRET
+    client._init_encryption_key()
+    return client
+
+
+def _timeit(func, rounds: int) -> float:
+    """返回单次调用的平均 CPU 耗时（微秒）"""
+    func()
+    start = time.process_time()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - start) / rounds * 1e6
+
+
+def bench_v1(client, rounds: int, with_info: bool):
+    request_data = {"device_id": DEVICE_ID, "software_name": SOFTWARE_NAME}
+    if with_info:
+        request_data["device_info"] = DEVICE_INFO
+    response_data = {"authorized": True, "message": "设备已授权"}
+
+    request_body = json.dumps({"encrypted_data": client._encrypt_data(request_data)}).encode("utf-8")
+    response_body = json.dumps({"encrypted_data": encrypt_response_data(response_data)}).encode("utf-8")
+
+    def client_side():
+        json.dumps({"encrypted_data": client._encrypt_data(request_data)})
+        client._decrypt_data(json.loads(response_body)["encrypted_data"])
+
+    def server_side():
+        decrypt_request_data(json.loads(request_body)["encrypted_data"])
+        json.dumps({"encrypted_data": encrypt_response_data(response_data)})
+
+    return len(request_body), len(response_body), _timeit(client_side, rounds), _timeit(server_side, rounds)
+
+
+def bench_v2(aead, rounds: int, with_info: bool):
+    device_info = DEVICE_INFO if with_info else None
+    request_body = encode_request_v2(aead, DEVICE_ID, SOFTWARE_NAME, device_info)
+    response_body = protocol.encode_response(True)
+    assert protocol.decode_request(request_body)["device_id"] == DEVICE_ID
+    assert decode_response_v2(aead, response_body) is True
+
+    def client_side():
+        encode_request_v2(aead, DEVICE_ID, SOFTWARE_NAME, device_info)
+        decode_response_v2(aead, response_body)
+
+    def server_side():
+        protocol.decode_request(request_body)
+        protocol.encode_response(True)
+
+    return len(request_body), len(response_body), _timeit(client_side, rounds), _timeit(server_side, rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="心跳协议 v1/v2 编解码基准")
+    parser.add_argument("-n", "--rounds", type=int, default=20000, help="每项测量的循环次数")
+    args = parser.parse_args()
+
+    client = _make_client()
+    aead = AESGCM(derive_v2_key(CLIENT_SECRET))
+
+    header = f"{'场景':<16}{'协议':<6}{'请求字节':>10}{'响应字节':>10}{'客户端 µs':>12}{'服务端 µs':>12}"
+    print(header)
+    print("-" * len(header))
+    for label, with_info in (("带 device_info", True), ("仅 device_id", False)):
+        rows = {"v1": bench_v1(client, args.rounds, with_info), "v2": bench_v2(aead, args.rounds, with_info)}
+        for version, (req, resp, client_us, server_us) in rows.items():
+            print(f"{label:<16}{version:<6}{req:>10}{resp:>10}{client_us:>12.1f}{server_us:>12.1f}")
+        v1, v2 = rows["v1"], rows["v2"]
+        print(f"{'':<16}{'v2/v1':<6}{v2[0] / v1[0]:>10.0%}{v2[1] / v1[1]:>10.0%}"
+              f"{v2[2] / v1[2]:>12.0%}{v2[3] / v1[3]:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
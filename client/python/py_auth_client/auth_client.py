@@ -10,6 +10,7 @@ Python授权客户端模块
 
 网络传输：
 - 使用AES加密保护请求和响应数据
+- 默认使用 v2 协议（AES-GCM + 二进制负载），服务端不支持时自动回退到 v1（Fernet + JSON）
 """
 import requests
 import logging
@@ -27,6 +28,7 @@ from typing import Optional, Dict, Any
 from pathlib import Path
 import psutil
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import logging
 
 from .device_utils import (
@@ -35,6 +37,50 @@ from .device_utils import (
     collect_device_facts,
 )
 
+# 心跳协议 v2：版本(1) | nonce(12) | AES-GCM(负载) + tag(16)，格式见服务端 app/protocol.py
+PROTOCOL_V2_CONTENT_TYPE = "application/x-py-auth-v2"
+_V2_VERSION = 2
+_V2_NONCE_SIZE = 12
+_V2_AAD_REQUEST = bytes([_V2_VERSION]) + b"Q"
+_V2_AAD_RESPONSE = bytes([_V2_VERSION]) + b"R"
+
+
+def derive_v2_key(client_secret: str) -> bytes:
+    """派生 v2 协议的 AES-GCM 密钥（与 v1 的 Fernet 密钥分开）"""
+    return hashlib.sha256(b"py-auth-v2:" + client_secret.encode('utf-8')).digest()
+
+
+def encode_request_v2(aead: AESGCM, device_id: str, software_name: Optional[str],
+                      device_info: Optional[Dict[str, Any]]) -> bytes:
+    """编码并加密 v2 心跳请求"""
+    flags = 0
+    parts = []
+    device_id_bytes = device_id.encode('utf-8')
+    parts.append(struct.pack('>H', len(device_id_bytes)) + device_id_bytes)
+    if software_name is not None:
+        flags |= 0x01
+        name_bytes = software_name.encode('utf-8')
+        parts.append(struct.pack('>H', len(name_bytes)) + name_bytes)
+    if device_info is not None:
+        flags |= 0x02
+        info_bytes = json.dumps(device_info, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        parts.append(struct.pack('>I', len(info_bytes)) + info_bytes)
+    payload = bytes([flags]) + b''.join(parts)
+    nonce = os.urandom(_V2_NONCE_SIZE)
+    return bytes([_V2_VERSION]) + nonce + aead.encrypt(nonce, payload, _V2_AAD_REQUEST)
+
+
+def decode_response_v2(aead: AESGCM, body: bytes) -> Optional[bool]:
+    """解密 v2 心跳响应，返回是否已授权，失败返回 None"""
+    if len(body) < 1 + _V2_NONCE_SIZE or body[0] != _V2_VERSION:
+        return None
+    try:
+        payload = aead.decrypt(body[1:1 + _V2_NONCE_SIZE], body[1 + _V2_NONCE_SIZE:], _V2_AAD_RESPONSE)
+        return bool(payload[0] & 0x01)
+    except Exception:
+        return None
+
+
 class AuthCache:
     """授权缓存管理（混淆加密）"""
     
@@ -402,7 +448,8 @@ class AuthClient:
         enable_cache: bool = True,
         cache_validity_days: int = 7,
         check_interval_days: int = 2,
-        debug: bool = False
+        debug: bool = False,
+        protocol_version: int = 2
     ):
         """
         初始化授权客户端
@@ -418,8 +465,11 @@ class AuthClient:
             cache_validity_days: 缓存有效期（天），默认7天
             check_interval_days: 检查间隔（天），默认2天
             debug: 是否输出调试日志
+            protocol_version: 心跳协议版本，默认2（AES-GCM 二进制），服务端不支持时自动回退到1
         """
         self.debug = debug
+        self.protocol_version = protocol_version
+        self._v2_confirmed = False
         self.logger = logging.getLogger("py_auth_client")
         if debug:
             if not self.logger.handlers:
@@ -537,6 +587,7 @@ class AuthClient:
         key_bytes = hashlib.sha256(self.client_secret.encode('utf-8')).digest()
         key = base64.urlsafe_b64encode(key_bytes)
         self.cipher = Fernet(key)
+        self.aead = AESGCM(derive_v2_key(self.client_secret))
     
     def _encrypt_data(self, data: Dict[str, Any]) -> str:
         """加密数据"""
@@ -552,7 +603,68 @@ class AuthClient:
             return None
     
     def _check_online(self) -> Dict[str, Any]:
-        """在线检查授权状态（使用AES加密）"""
+        """在线检查授权状态（使用AES加密），优先使用 v2 协议"""
+        if self.protocol_version < 2:
+            return self._check_online_v1()
+        result = self._check_online_v2()
+        if result is not None:
+            return result
+        # v2 未被服务端接受，改用 v1 重试；v1 成功说明服务端不支持 v2，后续请求直接使用 v1
+        result = self._check_online_v1()
+        if result.get('success'):
+            self._log_debug("服务端不支持 v2 协议，已回退到 v1")
+            self.protocol_version = 1
+        return result
+    
+    def _check_online_v2(self) -> Optional[Dict[str, Any]]:
+        """v2 协议在线检查，服务端不支持 v2 时返回 None"""
+        try:
+            self._log_debug("开始在线订阅请求（v2）...")
+            response = requests.post(
+                f"{self.server_url}/api/auth/heartbeat",
+                data=encode_request_v2(self.aead, self.device_id, self.software_name, self.device_info),
+                headers={"Content-Type": PROTOCOL_V2_CONTENT_TYPE},
+                timeout=10
+            )
+            
+            if response.status_code == 200:
+                if not response.headers.get("Content-Type", "").startswith(PROTOCOL_V2_CONTENT_TYPE):
+                    return None
+                authorized = decode_response_v2(self.aead, response.content)
+                if authorized is not None:
+                    self._v2_confirmed = True
+                    self._log_debug(f"在线订阅成功，authorized={authorized}")
+                    return {
+                        'authorized': authorized,
+                        'message': '设备已授权' if authorized else '设备未授权',
+                        'success': True,
+                        'from_cache': False
+                    }
+                self._log_debug("在线订阅响应解密失败")
+                return {'authorized': False, 'message': '解密响应失败', 'success': False, 'from_cache': False}
+            
+            # 旧版服务端无法把二进制请求体当作 JSON 解析（返回 422 或 500），在服务端确认支持 v2 之前交给 v1 重试
+            if not self._v2_confirmed and response.status_code != 403:
+                return None
+            
+            error_msg = response.json().get('detail', f'服务器错误: {response.status_code}') if response.status_code == 403 else f'服务器错误: {response.status_code}'
+            self._log_debug(f"在线订阅失败，status={response.status_code}, message={error_msg}")
+            return {
+                'authorized': False,
+                'message': error_msg,
+                'success': False,
+                'from_cache': False,
+                'is_auth_error': response.status_code == 403
+            }
+        except requests.exceptions.RequestException as e:
+            self._log_debug(f"在线订阅请求异常: {str(e)}")
+            return {'authorized': False, 'message': f'连接失败: {str(e)}', 'success': False, 'from_cache': False}
+        except Exception as e:
+            self._log_debug(f"在线订阅未知异常: {str(e)}")
+            return {'authorized': False, 'message': f'未知错误: {str(e)}', 'success': False, 'from_cache': False}
+    
+    def _check_online_v1(self) -> Dict[str, Any]:
+        """v1 协议在线检查（Fernet + JSON 信封）"""
         try:
             self._log_debug("开始在线订阅请求...")
             request_data = {
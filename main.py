@@ -3,11 +3,23 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from dotenv import load_dotenv
-from app.database import engine, Base, SessionLocal
+from app.database import engine, async_engine, replica_engine, Base, SessionLocal, AsyncSessionLocal, settings
+from app.heartbeat_buffer import heartbeat_buffer
+from app.decision_cache import decision_cache, preload_decisions
+from app.archive import device_archiver
+from app.changes import tombstone_pruner
+from app.counters import counter_reconciler, reconcile_counters
+from app.events import device_events
+from app.hashing import password_hasher
+from app.history import check_history, history_rollup
+from app.metrics import cleanup_multiprocess_dir, mark_process_dead, setup_metrics
+from app.sqlite_writer import sqlite_writer
+from app.stats import refresh_activity, stats_refresher
 from app.routers import auth, admin
 from app.routers import user as user_router
 from app.auth import init_admin_user
-from app.middleware import setup_cors
+from app.migrations import upgrade_schema
+from app.middleware import setup_cors, setup_gzip, setup_read_your_writes
 import logging
 import os
 import sys
@@ -18,8 +30,8 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def init_database():
-    """初始化数据库（使用文件锁确保多 worker 只执行一次）"""
+def init_database() -> bool:
+    """初始化数据库（使用文件锁确保多 worker 只执行一次），返回当前 worker 是否执行了初始化"""
     if sys.platform != "win32":
         import fcntl
         lock_file = "/tmp/py_auth_init.lock"
@@ -28,18 +40,47 @@ def init_database():
                 fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
                 try:
                     _do_init()
+                    return True
                 finally:
                     fcntl.flock(f, fcntl.LOCK_UN)
         except BlockingIOError:
             pass
         except Exception as e:
             logger.error(f"数据库初始化失败: {str(e)}")
+        return False
     else:
         _do_init()
+        return True
+
+# 后台单例任务的执行权：文件锁在进程存活期间一直持有，进程退出时由系统释放
+_leader_lock = None
+
+def acquire_leader() -> bool:
+    """争取后台单例任务（计数器对账、统计快照、墓碑清理、心跳历史汇总、冷设备归档）的执行权"""
+    global _leader_lock
+    if sys.platform == "win32":
+        return True
+    import fcntl
+    lock = open("/tmp/py_auth_leader.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+    _leader_lock = lock
+    return True
+
+def release_leader():
+    """释放单例任务的执行权"""
+    global _leader_lock
+    if _leader_lock is not None:
+        _leader_lock.close()
+        _leader_lock = None
 
 def _do_init():
     """执行数据库初始化"""
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
     logger.info("数据库表创建成功")
     db = SessionLocal()
     try:
@@ -47,11 +88,97 @@ def _do_init():
         logger.info(f"默认管理员账户: {admin_username} / {admin_password}")
     finally:
         db.close()
+    if decision_cache.shared:
+        # 共享决策表跨进程重启保留，清空上次运行遗留的条目
+        decision_cache.clear()
+
+async def warm_decision_cache():
+    """预热授权决策缓存"""
+    try:
+        async with AsyncSessionLocal() as db:
+            count = await preload_decisions(db)
+        logger.info(f"授权决策缓存已预热: {count} 个设备")
+    except Exception as e:
+        logger.error(f"授权决策缓存预热失败: {str(e)}")
+
+async def reconcile_device_counters():
+    """按 devices 表校准设备计数器"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await reconcile_counters(db)
+    except Exception as e:
+        logger.error(f"设备计数器校准失败: {str(e)}")
+
+async def refresh_fleet_stats():
+    """刷新活跃设备统计快照"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await refresh_activity(db, settings.stats_active_hours)
+    except Exception as e:
+        logger.error(f"设备统计刷新失败: {str(e)}")
+
+async def calibrate_password_hash():
+    """按本机速度校准密码哈希轮数"""
+    try:
+        await password_hasher.calibrate(settings.password_hash_target_ms, settings.password_hash_min_rounds)
+    except Exception as e:
+        logger.error(f"密码哈希轮数校准失败，使用默认轮数: {str(e)}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_database()
+    initialized = init_database()
+    if settings.sqlite_production and async_engine.dialect.name == "sqlite":
+        sqlite_writer.start()
+    if initialized:
+        # 清理上次运行遗留的指标文件
+        cleanup_multiprocess_dir()
+    # 计数器对账、统计快照、墓碑清理、心跳历史汇总和冷设备归档只由持有执行权的 worker 负责：
+    # 初始化锁在初始化完成后即释放，之后启动的 worker 同样会执行初始化，不能用来判断
+    if acquire_leader():
+        logger.info("当前 worker 负责执行后台单例任务")
+        await reconcile_device_counters()
+        if settings.device_counters_reconcile_interval > 0:
+            counter_reconciler.start()
+        await refresh_fleet_stats()
+        if settings.stats_refresh_interval > 0:
+            stats_refresher.start()
+        tombstone_pruner.start()
+        if settings.check_history_enabled:
+            history_rollup.start()
+        if settings.device_archive_after_days > 0:
+            device_archiver.start()
+    # 共享决策表只需由执行初始化的 worker 预热一次
+    if settings.decision_cache_enabled and settings.decision_cache_preload and (initialized or not decision_cache.shared):
+        await warm_decision_cache()
+    if settings.heartbeat_write_behind:
+        heartbeat_buffer.start()
+    if settings.check_history_enabled:
+        check_history.start()
+    device_events.start()
+    # 每个 worker 各自校准（轮数按粒度取整，登录时只在相差较大时重新哈希）
+    if settings.password_hash_target_ms > 0:
+        await calibrate_password_hash()
     yield
+    # 先结束事件流连接，避免关闭时等待长连接
+    await device_events.stop()
+    if settings.heartbeat_write_behind:
+        # 关闭前刷新缓冲中的心跳
+        await heartbeat_buffer.stop()
+    if settings.check_history_enabled:
+        await check_history.stop()
+    await history_rollup.stop(final_run=False)
+    await device_archiver.stop(final_run=False)
+    await counter_reconciler.stop(final_run=False)
+    await stats_refresher.stop(final_run=False)
+    await tombstone_pruner.stop(final_run=False)
+    release_leader()
+    password_hasher.shutdown()
+    # 写回缓冲等刷新完成后再停止写入队列
+    await sqlite_writer.stop()
+    await async_engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+    mark_process_dead()
 
 app = FastAPI(
     title="Python授权服务",
@@ -62,6 +189,12 @@ app = FastAPI(
 
 # CORS配置
 setup_cors(app)
+# 响应压缩
+setup_gzip(app)
+# 只读副本的 read-your-writes
+setup_read_your_writes(app)
+# Prometheus 指标（GET /metrics，需在 SPA 路由之前注册）
+setup_metrics(app)
 
 # 注册路由
 app.include_router(auth.router)
@@ -79,13 +79,16 @@ class ApiService {
   }
 
   async changePassword(oldPassword, newPassword) {
-    return this.request('/user/change-password', {
+    const data = await this.request('/user/change-password', {
       method: 'POST',
       body: JSON.stringify({
         old_password: oldPassword,
         new_password: newPassword
       })
     })
+    // 修改密码后旧令牌失效，改用响应中的新令牌
+    if (data.access_token) this.setToken(data.access_token)
+    return data
   }
 
   logout() {
@@ -93,8 +96,24 @@ class ApiService {
   }
 
   // 设备管理
-  async getDevices(page = 1, pageSize = 10) {
-    return this.request(`/admin/devices?page=${page}&page_size=${pageSize}`)
+  // 列表默认不返回设备信息（device_info=none），查看详情时再单独获取
+  // params：过滤条件（software_name、is_authorized、hostname 等）和排序（sort、order）
+  async getDevices(page = 1, pageSize = 10, params = {}) {
+    const query = new URLSearchParams({ page, page_size: pageSize, device_info: 'none' })
+    for (const [key, value] of Object.entries(params)) {
+      if (value !== null && value !== undefined && value !== '') query.set(key, value)
+    }
+    return this.request(`/admin/devices?${query}`)
+  }
+
+  // 设备统计：总数、已授权、已撤销、最近 hours 小时活跃数（服务端快照）
+  // 不传 hours 时由服务端从 STATS_ACTIVE_HOURS 中选择窗口（优先 24），响应中的 hours 为实际使用的窗口
+  async getStats(hours = null) {
+    return this.request(hours === null ? '/admin/stats' : `/admin/stats?hours=${hours}`)
+  }
+
+  async getDevice(deviceId) {
+    return this.request(`/admin/devices/${encodeURIComponent(deviceId)}`)
   }
 
   async updateDevice(deviceId, data) {
@@ -104,11 +123,76 @@ class ApiService {
     })
   }
 
+  // 批量操作：action 为 authorize / revoke / delete，目标为 device_id 列表或过滤条件（二选一）
+  async bulkDevices(action, { deviceIds = null, filters = null } = {}) {
+    return this.request('/admin/devices/bulk', {
+      method: 'POST',
+      body: JSON.stringify({ action, device_ids: deviceIds, filters })
+    })
+  }
+
+  // 导出设备（CSV / NDJSON），返回文件内容和文件名
+  async exportDevices(format = 'csv', params = {}) {
+    const query = new URLSearchParams({ format })
+    for (const [key, value] of Object.entries(params)) {
+      if (value !== null && value !== undefined && value !== '') query.set(key, value)
+    }
+    const headers = {}
+    if (this.token) {
+      headers['Authorization'] = `Bearer ${this.token}`
+    }
+    const response = await fetch(`${API_BASE}/admin/devices/export?${query}`, { headers })
+    if (response.status === 401) {
+      this.setToken(null)
+      throw new Error('登录已过期，请重新登录')
+    }
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`)
+    }
+    const match = /filename="([^"]+)"/.exec(response.headers.get('Content-Disposition') || '')
+    return { blob: await response.blob(), filename: match ? match[1] : `devices.${format}` }
+  }
+
   async deleteDevice(deviceId) {
     return this.request(`/admin/devices/${encodeURIComponent(deviceId)}`, {
       method: 'DELETE'
     })
   }
+
+  // 设备事件流（SSE）：用 fetch 读取以便携带 Authorization 头，连接结束时返回，由调用方重连
+  async streamEvents(onEvent, signal) {
+    const headers = { Accept: 'text/event-stream' }
+    if (this.token) {
+      headers['Authorization'] = `Bearer ${this.token}`
+    }
+    const response = await fetch(`${API_BASE}/admin/events`, { headers, signal })
+    if (response.status === 401) {
+      this.setToken(null)
+      throw new Error('登录已过期，请重新登录')
+    }
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`)
+    }
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+    let buffer = ''
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) return
+      buffer += value
+      let end
+      while ((end = buffer.indexOf('\n\n')) >= 0) {
+        const block = buffer.slice(0, end)
+        buffer = buffer.slice(end + 2)
+        let type = 'message'
+        let data = ''
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event: ')) type = line.slice(7)
+          else if (line.startsWith('data: ')) data += line.slice(6)
+        }
+        if (data) onEvent(type, JSON.parse(data))
+      }
+    }
+  }
 }
 
 export const api = new ApiService()